@@ -0,0 +1,121 @@
+"""bench_attribute_conversion.py
+
+Compares the per layer attribute converter with the conversion the plugin
+did before it, get_feature_attributes plus clean_row, on a wide layer with
+empty values, checking that both give the same output values
+
+    python benchmarks/bench_attribute_conversion.py --features 100000
+"""
+
+import argparse
+import random
+from time import perf_counter
+
+from datetime import date, datetime
+
+from qgis.core import QgsFeature, QgsVectorLayer
+from qgis.PyQt.QtCore import QDate, QDateTime, QTime, QVariant
+
+from common import import_plugin, start_qgis
+
+FIELD_TYPES = ("string", "integer", "double", "date", "datetime")
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--features", type=int, default=50000)
+    parser.add_argument("--fields", type=int, default=40)
+    parser.add_argument("--selected", type=int, default=20)
+    parser.add_argument("--empty", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+def get_feature_attributes(feature):
+    """All the attributes of a feature, without the empty ones, as the
+    plugin read them before the converters"""
+    attr_map = feature.attributeMap()
+    for key, value in attr_map.copy().items():
+        if value is None:
+            del attr_map[key]
+        if str(value).strip() in ("NULL", ""):
+            del attr_map[key]
+        elif type(value) is QVariant and value.isNull():
+            del attr_map[key]
+        elif type(value) is QDate:
+            attr_map[key] = value.toPyDate()
+        elif type(value) is QDateTime:
+            attr_map[key] = value.toPyDateTime()
+    return attr_map
+
+
+def clean_row(attributes):
+    for key, value in attributes.items():
+        if type(value) in (date, datetime):
+            attributes[key] = value.isoformat()
+    return attributes
+
+
+def random_value(rnd, field_type, empty):
+    if rnd.random() < empty:
+        return None if rnd.random() < 0.8 else ""
+    if field_type == "string":
+        return f"value {rnd.randint(0, 1000)} "
+    if field_type == "integer":
+        return rnd.randint(-1000, 1000)
+    if field_type == "double":
+        return rnd.uniform(-1000, 1000)
+    day = QDate(2000, 1, 1).addDays(rnd.randint(0, 9000))
+    if field_type == "date":
+        return day
+    return QDateTime(day, QTime(rnd.randint(0, 23), rnd.randint(0, 59)))
+
+
+def make_wide_layer(n_features, n_fields, empty, seed):
+    """Memory layer without geometry with n_fields of mixed types"""
+    rnd = random.Random(seed)
+    types = [FIELD_TYPES[i % len(FIELD_TYPES)] for i in range(n_fields)]
+    uri = "None?" + "&".join(
+        f"field=attr_{i}:{field_type}" for i, field_type in enumerate(types)
+    )
+    layer = QgsVectorLayer(uri, "wide", "memory")
+    features = []
+    for _ in range(n_features):
+        feat = QgsFeature(layer.fields())
+        feat.setAttributes([random_value(rnd, t, empty) for t in types])
+        features.append(feat)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+def main():
+    args = get_arguments()
+    app = start_qgis()
+    plugin = import_plugin()
+    tools = plugin.tools
+    layer = make_wide_layer(args.features, args.fields, args.empty, args.seed)
+    names = tuple(layer.fields().names()[: args.selected])
+    features = list(layer.getFeatures())
+
+    start = perf_counter()
+    previous = []
+    for feat in features:
+        attributes = clean_row(get_feature_attributes(feat))
+        previous.append(tuple(attributes.get(name) for name in names))
+    previous_time = perf_counter() - start
+
+    start = perf_counter()
+    convert = tools.get_attribute_converter(layer.fields(), names)
+    converted = [convert(feat) for feat in features]
+    converter_time = perf_counter() - start
+
+    assert converted == previous, "the converter changed the output values"
+    print(f"features: {len(features)}, fields: {args.fields}, selected: {len(names)}")
+    print(f"get_feature_attributes: {previous_time:.3f} s")
+    print(f"converter:              {converter_time:.3f} s")
+    print(f"speedup:                {previous_time / converter_time:.2f}x")
+    app.exitQgis()
+
+
+if __name__ == "__main__":
+    main()
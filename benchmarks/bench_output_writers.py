@@ -0,0 +1,93 @@
+"""bench_output_writers.py
+
+Compares the throughput of the csv and xlsx stream writers on synthetic
+results, one million rows by default, and the peak memory of each
+
+    python benchmarks/bench_output_writers.py --rows 1000000
+"""
+
+import argparse
+import random
+import resource
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+from common import import_plugin, start_qgis
+
+ATTRIBUTES = ("class", "name", "status", "owner", "date", "empty")
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--layers", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+def make_results(plugin, n_rows, n_layers, seed):
+    """Yields IntersectionResult records like the analysis does"""
+    rnd = random.Random(seed)
+    IntersectionResult = plugin.results.IntersectionResult
+    for i in range(n_rows):
+        yield IntersectionResult(
+            i // 1000,
+            f"line {i // 1000}",
+            f"layer {i % n_layers}",
+            i,
+            rnd.randint(1, 4),
+            rnd.uniform(0, 500),
+            rnd.uniform(0, 50000),
+            ATTRIBUTES,
+            (
+                rnd.choice(("A", "B", "C")),
+                f"feature {i}",
+                rnd.choice(("open", "closed", None)),
+                rnd.randint(1, 100),
+                f"20{rnd.randint(10, 24)}-0{rnd.randint(1, 9)}-1{rnd.randint(0, 9)}",
+                None,
+            ),
+        )
+
+
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    args = get_arguments()
+    app = start_qgis()
+    plugin = import_plugin()
+    outputWriter = plugin.outputWriter
+    layer_attr_map = {
+        f"layer {i}": (True, {name: True for name in ATTRIBUTES})
+        for i in range(args.layers)
+    }
+    writers = {"csv": outputWriter.CSVStreamWriter}
+    if outputWriter.is_xlsx_available():
+        writers["xlsx"] = outputWriter.XLSXStreamWriter
+    else:
+        print("openpyxl is not installed, only timing csv")
+    with tempfile.TemporaryDirectory() as folder:
+        folder = Path(folder)
+        for name, writer_class in writers.items():
+            writer = writer_class(folder, layer_attr_map)
+            start = perf_counter()
+            writer.open()
+            for result in make_results(plugin, args.rows, args.layers, args.seed):
+                writer.write(result)
+            scan = perf_counter() - start
+            writer.close()
+            total = perf_counter() - start
+            print(
+                f"{name}: {writer.rows} rows in {total:.2f} s "
+                f"({writer.rows / total:,.0f} rows/s, {scan:.2f} s while "
+                f"streaming), {writer.bytes_written / 2**20:.1f} MB, "
+                f"peak RSS {peak_rss():.1f} MB"
+            )
+    app.exitQgis()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""bench_prepared_engine.py
+
+Compares CheckIntersections with and without the prepared geometry engine,
+checking that both give the same results
+
+    python benchmarks/bench_prepared_engine.py
+"""
+
+from time import perf_counter
+
+from common import (
+    import_plugin,
+    layer_attr_map_for,
+    make_prospect_layer,
+    make_search_layer,
+    start_qgis,
+)
+
+
+def summary(results):
+    return [
+        (
+            result.prospect_id,
+            result.layer_name,
+            result.feature_id,
+            result.intersections,
+            result.length,
+            result.area,
+        )
+        for result in results
+    ]
+
+
+def main():
+    app = start_qgis()
+    plugin = import_plugin()
+    CheckIntersections = plugin.lineAnalysis.CheckIntersections
+    prospect_layer = make_prospect_layer()
+    layers = (make_search_layer("roads"), make_search_layer("parcels", seed=3))
+    layer_attr_map = layer_attr_map_for(layers)
+    timings = {}
+    outputs = {}
+    for prepared in (False, True):
+        task = CheckIntersections(
+            layers, prospect_layer, layer_attr_map, prepared=prepared
+        )
+        start = perf_counter()
+        task.run()
+        timings[prepared] = perf_counter() - start
+        outputs[prepared] = summary(task.results)
+    assert outputs[True] == outputs[False], "prepared engine changed the results"
+    print(f"hits:     {len(outputs[True])}")
+    print(f"plain:    {timings[False]:.3f} s")
+    print(f"prepared: {timings[True]:.3f} s")
+    print(f"speedup:  {timings[False] / timings[True]:.2f}x")
+    app.exitQgis()
+
+
+if __name__ == "__main__":
+    main()
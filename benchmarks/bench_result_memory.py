@@ -0,0 +1,109 @@
+"""bench_result_memory.py
+
+Compares the memory held by the results of CheckIntersections, as compact
+IntersectionResult records and as the previous dicts holding the prospect
+feature, the layer and the full candidate feature
+
+The compact records are rebuilt with copies of their attribute values, so
+the values are counted like in a real run, and also measured with
+tracemalloc. The dicts hold QGIS objects that tracemalloc does not see, they
+are only measured by the resident memory.
+
+    python benchmarks/bench_result_memory.py
+"""
+
+import gc
+import pickle
+import resource
+import tracemalloc
+
+from common import (
+    import_plugin,
+    layer_attr_map_for,
+    make_prospect_layer,
+    make_search_layer,
+    start_qgis,
+)
+
+
+def current_rss():
+    """Resident memory of the process in MB"""
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+        return pages * resource.getpagesize() / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def as_dicts(results, prospect_layer, layers):
+    """Rebuilds the results the way they were stored before"""
+    layers = {layer.name(): layer for layer in layers}
+    lines = {line.id(): line for line in prospect_layer.getFeatures()}
+    return [
+        {
+            "prospect_layer": prospect_layer,
+            "prospect_feature": lines[result.prospect_id],
+            "layer": layers[result.layer_name],
+            "feature": layers[result.layer_name].getFeature(result.feature_id),
+            "intersections": result.intersections,
+            "length": result.length,
+            "area": result.area,
+        }
+        for result in results
+    ]
+
+
+def main():
+    app = start_qgis()
+    plugin = import_plugin()
+    prospect_layer = make_prospect_layer(n_lines=20)
+    layers = (
+        make_search_layer("roads", n_features=20000),
+        make_search_layer("parcels", n_features=20000, seed=3),
+    )
+    task = plugin.lineAnalysis.CheckIntersections(
+        layers, prospect_layer, layer_attr_map_for(layers)
+    )
+    task.run()
+    hits = len(task.results)
+    compact = task.results
+    gc.collect()
+    before = current_rss()
+    dicts = as_dicts(compact, prospect_layer, layers)
+    gc.collect()
+    dict_memory = current_rss() - before
+    del dicts, task
+    gc.collect()
+    before = current_rss()
+    tracemalloc.start()
+    copies = [
+        plugin.results.IntersectionResult(
+            result.prospect_id,
+            result.prospect_line,
+            result.layer_name,
+            result.feature_id,
+            result.intersections,
+            result.length,
+            result.area,
+            result.attribute_names,
+            # a new tuple of new values, tuple() would return the same one
+            pickle.loads(pickle.dumps(result.attribute_values)),
+        )
+        for result in compact
+    ]
+    gc.collect()
+    traced = tracemalloc.get_traced_memory()[0] / 2**20
+    tracemalloc.stop()
+    compact_memory = current_rss() - before
+    print(f"hits:            {hits}")
+    print(f"dict results:    {dict_memory:.1f} MB")
+    print(f"compact results: {compact_memory:.1f} MB ({traced:.1f} MB traced)")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"peak RSS:        {peak:.1f} MB")
+    del copies
+    app.exitQgis()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""bench_subdivision.py
+
+Compares CheckIntersections with and without the subdivision of huge search
+polygons, on a few wavy polygons with many vertices, checking that both give
+the same part counts, lengths and areas
+
+    python benchmarks/bench_subdivision.py --vertices 200000 --max-vertices 256
+"""
+
+import argparse
+import math
+from time import perf_counter
+
+from qgis.core import QgsFeature, QgsGeometry, QgsPointXY, QgsVectorLayer
+
+from common import (
+    import_plugin,
+    layer_attr_map_for,
+    make_prospect_layer,
+    start_qgis,
+)
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--polygons", type=int, default=4)
+    parser.add_argument("--vertices", type=int, default=100000)
+    parser.add_argument("--max-vertices", type=int, default=256)
+    parser.add_argument("--lines", type=int, default=20)
+    parser.add_argument("--size", type=float, default=10000)
+    return parser.parse_args()
+
+
+def make_huge_polygons(n_polygons, n_vertices, size):
+    """Memory layer of round polygons with a wavy border of n_vertices"""
+    layer = QgsVectorLayer("Polygon?crs=EPSG:3857&field=name:string", "huge", "memory")
+    features = []
+    for i in range(n_polygons):
+        cx = size * (i + 0.5) / n_polygons
+        cy = size / 2
+        radius = size / n_polygons / 2
+        ring = []
+        for j in range(n_vertices):
+            angle = 2 * math.pi * j / n_vertices
+            r = radius * (0.9 + 0.05 * math.sin(angle * 200))
+            ring.append(QgsPointXY(cx + r * math.cos(angle), cy + r * math.sin(angle)))
+        feat = QgsFeature(layer.fields())
+        feat.setGeometry(QgsGeometry.fromPolygonXY([ring]))
+        feat.setAttributes([f"polygon {i}"])
+        features.append(feat)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+def summary(results):
+    return [
+        (
+            result.prospect_id,
+            result.feature_id,
+            result.intersections,
+            round(result.length, 1),
+            round(result.area, 1),
+        )
+        for result in results
+    ]
+
+
+def main():
+    args = get_arguments()
+    app = start_qgis()
+    plugin = import_plugin()
+    CheckIntersections = plugin.lineAnalysis.CheckIntersections
+    prospect_layer = make_prospect_layer(args.lines, 50, args.size)
+    layers = (make_huge_polygons(args.polygons, args.vertices, args.size),)
+    layer_attr_map = layer_attr_map_for(layers)
+    timings = {}
+    outputs = {}
+    for max_vertices in (0, args.max_vertices):
+        task = CheckIntersections(
+            layers, prospect_layer, layer_attr_map, max_vertices=max_vertices
+        )
+        start = perf_counter()
+        task.run()
+        timings[max_vertices] = perf_counter() - start
+        outputs[max_vertices] = summary(task.results)
+    assert outputs[0] == outputs[args.max_vertices], "subdivision changed the results"
+    print(f"hits:        {len(outputs[0])}")
+    print(f"whole:       {timings[0]:.3f} s")
+    print(f"subdivided:  {timings[args.max_vertices]:.3f} s")
+    print(f"speedup:     {timings[0] / timings[args.max_vertices]:.2f}x")
+    app.exitQgis()
+
+
+if __name__ == "__main__":
+    main()
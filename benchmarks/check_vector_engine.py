@@ -0,0 +1,57 @@
+"""check_vector_engine.py
+
+Runs CheckIntersections with the QGIS geometry engine and with the
+Shapely engine, checking that both find the same hits and measures
+
+    python benchmarks/check_vector_engine.py
+"""
+
+from math import isclose
+from time import perf_counter
+
+from common import (
+    import_plugin,
+    layer_attr_map_for,
+    make_prospect_layer,
+    make_search_layer,
+    start_qgis,
+)
+
+
+def main():
+    app = start_qgis()
+    plugin = import_plugin()
+    if not plugin.vectorEngine.is_available():
+        raise SystemExit("Shapely 2 and NumPy are needed")
+    CheckIntersections = plugin.lineAnalysis.CheckIntersections
+    prospect_layer = make_prospect_layer()
+    layers = (make_search_layer("roads"), make_search_layer("parcels", seed=3))
+    layer_attr_map = layer_attr_map_for(layers)
+    timings = {}
+    outputs = {}
+    for vectorized in (False, True):
+        task = CheckIntersections(
+            layers, prospect_layer, layer_attr_map, vectorized=vectorized
+        )
+        start = perf_counter()
+        task.run()
+        timings[vectorized] = perf_counter() - start
+        outputs[vectorized] = task.results
+    assert len(outputs[True]) == len(outputs[False]), "different number of hits"
+    for qgis, vector in zip(outputs[False], outputs[True]):
+        assert (qgis.prospect_id, qgis.layer_name, qgis.feature_id) == (
+            vector.prospect_id,
+            vector.layer_name,
+            vector.feature_id,
+        ), f"different hits: {qgis} {vector}"
+        assert qgis.intersections == vector.intersections, f"{qgis} {vector}"
+        assert isclose(qgis.length, vector.length, abs_tol=1e-3), f"{qgis} {vector}"
+        assert isclose(qgis.area, vector.area, abs_tol=1e-4), f"{qgis} {vector}"
+    print(f"hits:    {len(outputs[True])}")
+    print(f"qgis:    {timings[False]:.3f} s")
+    print(f"shapely: {timings[True]:.3f} s")
+    app.exitQgis()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""common.py
+
+Helpers shared by the benchmark scripts: offline QGIS start up, plugin import
+and reproducible synthetic memory or GeoPackage layers
+"""
+
+import importlib
+import os
+import random
+import sys
+from pathlib import Path
+
+from qgis.core import (
+    QgsApplication,
+    QgsCoordinateTransformContext,
+    QgsFeature,
+    QgsGeometry,
+    QgsPointXY,
+    QgsRectangle,
+    QgsVectorFileWriter,
+    QgsVectorLayer,
+)
+
+PLUGIN_FOLDER = Path(__file__).absolute().parents[1]
+
+
+def start_qgis():
+    """Starts a headless QgsApplication, returns it to be closed with exitQgis"""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = QgsApplication([], False)
+    app.initQgis()
+    return app
+
+
+def import_plugin():
+    """Imports the plugin folder as a package, so its relative imports work"""
+    sys.path.insert(0, str(PLUGIN_FOLDER.parent))
+    return importlib.import_module(PLUGIN_FOLDER.name)
+
+
+def make_prospect_layer(n_lines=5, n_vertices=200, size=10000, seed=1):
+    """Memory layer with long random walking lines"""
+    rnd = random.Random(seed)
+    layer = QgsVectorLayer(
+        "LineString?crs=EPSG:3857&field=name:string", "prospect", "memory"
+    )
+    features = []
+    for i in range(n_lines):
+        x, y = rnd.uniform(0, size), rnd.uniform(0, size)
+        points = []
+        for _ in range(n_vertices):
+            x += rnd.uniform(-size / 50, size / 50)
+            y += rnd.uniform(-size / 50, size / 50)
+            points.append(QgsPointXY(x, y))
+        feat = QgsFeature(layer.fields())
+        feat.setGeometry(QgsGeometry.fromPolylineXY(points))
+        feat.setAttributes([f"line {i}"])
+        features.append(feat)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+def random_geometry(rnd, geometry, size):
+    """Random point, short segment or small square inside a size x size area"""
+    x, y = rnd.uniform(0, size), rnd.uniform(0, size)
+    if geometry == "point":
+        return QgsGeometry.fromPointXY(QgsPointXY(x, y))
+    if geometry == "polygon":
+        side = rnd.uniform(size / 200, size / 40)
+        return QgsGeometry.fromRect(QgsRectangle(x, y, x + side, y + side))
+    return QgsGeometry.fromPolylineXY(
+        [
+            QgsPointXY(x, y),
+            QgsPointXY(
+                x + rnd.uniform(-size / 20, size / 20),
+                y + rnd.uniform(-size / 20, size / 20),
+            ),
+        ]
+    )
+
+
+def make_search_layer(
+    name="roads", n_features=5000, size=10000, seed=2, geometry="line"
+):
+    """Memory layer with random points, short segments or small squares"""
+    rnd = random.Random(seed)
+    layer_type = {"point": "Point", "line": "LineString", "polygon": "Polygon"}
+    layer = QgsVectorLayer(
+        f"{layer_type[geometry]}?crs=EPSG:3857&field=id:integer&field=kind:string",
+        name,
+        "memory",
+    )
+    features = []
+    for i in range(n_features):
+        feat = QgsFeature(layer.fields())
+        feat.setGeometry(random_geometry(rnd, geometry, size))
+        feat.setAttributes([i, rnd.choice(("A", "B", "C"))])
+        features.append(feat)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+def save_geopackage(layer, path):
+    """Writes a layer as a table of a GeoPackage and loads it back"""
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = "GPKG"
+    options.layerName = layer.name()
+    if Path(path).exists():
+        options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteLayer
+    QgsVectorFileWriter.writeAsVectorFormatV3(
+        layer, str(path), QgsCoordinateTransformContext(), options
+    )
+    return QgsVectorLayer(f"{path}|layername={layer.name()}", layer.name(), "ogr")
+
+
+def layer_attr_map_for(layers):
+    """A layer_attr_map that enables every layer and attribute"""
+    return {
+        layer.name(): (True, {field.name(): True for field in layer.fields()})
+        for layer in layers
+    }
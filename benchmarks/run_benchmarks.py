@@ -0,0 +1,147 @@
+"""run_benchmarks.py
+
+Times CheckIntersections and WriteCSVTask end to end and per stage on
+reproducible synthetic layers, and prints the report as JSON
+
+    python benchmarks/run_benchmarks.py --lines 20 --features 50000
+    python benchmarks/run_benchmarks.py --storage gpkg --output bench.json
+"""
+
+import argparse
+import json
+import platform
+import resource
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+from qgis.core import Qgis
+
+from common import (
+    import_plugin,
+    layer_attr_map_for,
+    make_prospect_layer,
+    make_search_layer,
+    save_geopackage,
+    start_qgis,
+)
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--lines", type=int, default=10, help="prospect lines")
+    parser.add_argument("--vertices", type=int, default=200, help="per line")
+    parser.add_argument("--features", type=int, default=20000, help="per layer")
+    parser.add_argument(
+        "--geometries",
+        default="point,line,polygon",
+        help="comma separated search layer geometries",
+    )
+    parser.add_argument("--size", type=float, default=10000, help="area side")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--storage", choices=("memory", "gpkg"), default="memory")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--segment-length", type=float, default=0)
+    parser.add_argument("--no-prepared", action="store_true")
+    parser.add_argument("--vectorized", action="store_true")
+    parser.add_argument("--layer-major", action="store_true")
+    parser.add_argument("--max-vertices", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="also write the JSON here")
+    return parser.parse_args()
+
+
+def peak_rss():
+    """Peak resident memory of the process in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_once(plugin, prospect_layer, layers, layer_attr_map, args, folder):
+    """Runs the analysis stage by stage as CheckIntersections.run does"""
+    task = plugin.lineAnalysis.CheckIntersections(
+        layers,
+        prospect_layer,
+        layer_attr_map,
+        prepared=not args.no_prepared,
+        segment_length=args.segment_length,
+        vectorized=args.vectorized,
+        layer_major=args.layer_major,
+        max_vertices=args.max_vertices,
+    )
+    stages = {}
+    start = perf_counter()
+    task.reset()
+    task.prepare()
+    stages["prepare"] = perf_counter() - start
+    start = perf_counter()
+    for line in task.lines:
+        task.results += task.check_intersections(line)
+    stages["scan"] = perf_counter() - start
+    start = perf_counter()
+    task.finish()
+    stages["finish"] = perf_counter() - start
+    writer = plugin.outputWriter.WriteCSVTask(
+        folder, task.results, layer_attr_map, stats=task.stats
+    )
+    start = perf_counter()
+    writer.run()
+    stages["write_csv"] = perf_counter() - start
+    analysis = stages["prepare"] + stages["scan"] + stages["finish"]
+    total = analysis + stages["write_csv"]
+    return {
+        "stages": stages,
+        "analysis_seconds": analysis,
+        "total_seconds": total,
+        "features_checked": task.current_features_done,
+        "hits": len(task.results),
+        "features_per_second": task.current_features_done / analysis,
+        "hits_per_second": len(task.results) / analysis,
+        "csv_rows_per_second": len(task.results) / max(stages["write_csv"], 1e-9),
+        "csv_bytes": writer.filename.stat().st_size,
+        "run_stats": task.stats.as_dict(),
+    }
+
+
+def main():
+    args = get_arguments()
+    app = start_qgis()
+    plugin = import_plugin()
+    with tempfile.TemporaryDirectory() as folder:
+        folder = Path(folder)
+        prospect_layer = make_prospect_layer(
+            args.lines, args.vertices, args.size, args.seed
+        )
+        layers = []
+        for i, geometry in enumerate(args.geometries.split(",")):
+            layer = make_search_layer(
+                f"{geometry}s", args.features, args.size, args.seed + i + 1, geometry
+            )
+            if args.storage == "gpkg":
+                layer = save_geopackage(layer, folder / "search.gpkg")
+            layers.append(layer)
+        layer_attr_map = layer_attr_map_for(layers)
+        layers = tuple(layers)
+        runs = [
+            run_once(plugin, prospect_layer, layers, layer_attr_map, args, folder)
+            for _ in range(args.repeat)
+        ]
+        del layers
+    report = {
+        "qgis": Qgis.version(),
+        "python": platform.python_version(),
+        "arguments": {
+            key: str(value) if isinstance(value, Path) else value
+            for key, value in vars(args).items()
+        },
+        "runs": runs,
+        "best_total_seconds": min(run["total_seconds"] for run in runs),
+        "peak_rss_mb": peak_rss(),
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        args.output.write_text(text)
+    app.exitQgis()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""cache.py
+
+Persistent cache of the analysis results, stored next to the project
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from time import time
+
+from qgis.core import QgsProviderRegistry
+
+CACHE_FILENAME = "line_analysis_cache.sqlite"
+# part of every layer key, bumped when the cached hits change format
+CACHE_VERSION = 4
+
+# functions
+
+
+def get_geometry_key(geometry) -> str:
+    """Hash of a geometry, to recognise a prospect line that did not change"""
+    return hashlib.sha1(bytes(geometry.asWkb())).hexdigest()
+
+
+def get_data_files(path) -> list[Path]:
+    """The file of a data source and the files next to it that an edit can
+    change alone: the GeoPackage write-ahead log and the shapefile
+    attributes and index"""
+    return [
+        path,
+        path.with_name(path.name + "-wal"),
+        path.with_suffix(".dbf"),
+        path.with_suffix(".shx"),
+    ]
+
+
+def get_file_stamp(path) -> list:
+    """Last modification time and size of a file, None if it does not exist"""
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def get_layer_stamp(layer) -> list:
+    """Data source, modification time and size of its files and feature
+    count of a layer, any saved edit to a file layer changes at least one
+    of them"""
+    parts = QgsProviderRegistry.instance().decodeUri(
+        layer.providerType(), layer.source()
+    )
+    files = []
+    if parts.get("path"):
+        files = [get_file_stamp(path) for path in get_data_files(Path(parts["path"]))]
+    return [layer.source(), files, layer.featureCount()]
+
+
+def is_cacheable(layer) -> bool:
+    """If the stamp of layer changes with its data: a file layer without
+    unsaved edits, memory and database layers change without a file date"""
+    if layer.isModified():
+        return False
+    path = (
+        QgsProviderRegistry.instance()
+        .decodeUri(layer.providerType(), layer.source())
+        .get("path")
+    )
+    return bool(path) and Path(path).exists()
+
+
+# Classes
+
+
+class ResultCache:
+    """Results of the analysis per prospect line geometry and search layer
+
+    Lines are identified by a hash of their geometry and layers by their
+    stamp plus the selected attributes, so a rerun only recomputes the
+    pairs whose line or layer changed. New results are kept in memory until
+    save(), so subtasks only read from the file while they run. The pieces
+    of subdivided search features are kept the same way, by layer stamp.
+
+    Hits are stored as JSON (feature id, intersections, length, area,
+    distance), the attributes are read from the layer again on a hit.
+    """
+
+    def __init__(self, folder, refresh=False, max_age_days=30):
+        self.filename = Path(folder) / CACHE_FILENAME
+        self.refresh = refresh
+        self.max_age = max_age_days * 24 * 60 * 60
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._pending = []
+        self._pending_pieces = []
+        self._used = set()
+        with self.connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "line_key TEXT, layer_key TEXT, layer_source TEXT, used REAL, "
+                "hits BLOB, PRIMARY KEY (line_key, layer_key))"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS pieces ("
+                "layer_key TEXT, fid INTEGER, layer_source TEXT, used REAL, "
+                "wkb BLOB, PRIMARY KEY (layer_key, fid))"
+            )
+
+    def connect(self) -> sqlite3.Connection:
+        """Connection to the cache file for the current thread"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.filename, timeout=30, check_same_thread=False
+            )
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def get_layer_key(self, layer, attributes, distance=0) -> tuple[str, str]:
+        """Key of the current state of a search layer, and its data source"""
+        stamp = get_layer_stamp(layer) + [list(attributes), distance, CACHE_VERSION]
+        key = hashlib.sha1(json.dumps(stamp, default=str).encode()).hexdigest()
+        return key, layer.source()
+
+    def get_piece_key(self, layer, max_vertices) -> tuple[str, str]:
+        """Key of the subdivided features of a search layer, and its source"""
+        stamp = get_layer_stamp(layer) + [max_vertices, CACHE_VERSION]
+        key = hashlib.sha1(json.dumps(stamp, default=str).encode()).hexdigest()
+        return key, layer.source()
+
+    def get_pieces(self, piece_key, fid) -> list[bytes]:
+        """WKB of the pieces of a subdivided feature, None if not cached"""
+        if self.refresh:
+            return None
+        row = (
+            self.connect()
+            .execute(
+                "SELECT wkb FROM pieces WHERE layer_key = ? AND fid = ?",
+                (piece_key[0], fid),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        return [bytes.fromhex(wkb) for wkb in json.loads(row[0])]
+
+    def put_pieces(self, piece_key, fid, pieces):
+        """Stores the pieces of a subdivided feature, written on save()"""
+        with self._lock:
+            self._pending_pieces.append(
+                (
+                    piece_key[0],
+                    fid,
+                    piece_key[1],
+                    json.dumps([wkb.hex() for wkb in pieces]),
+                )
+            )
+
+    def get(self, line_key, layer_key) -> list[tuple]:
+        """Cached hits of a line and layer, None if they need to be computed"""
+        if self.refresh:
+            return None
+        row = (
+            self.connect()
+            .execute(
+                "SELECT hits FROM results WHERE line_key = ? AND layer_key = ?",
+                (line_key, layer_key[0]),
+            )
+            .fetchone()
+        )
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._used.add((line_key, layer_key[0]))
+        return json.loads(row[0])
+
+    def put(self, line_key, layer_key, hits):
+        """Stores the hits of a line and layer, written on save()"""
+        with self._lock:
+            self._pending.append((line_key, *layer_key, json.dumps(hits)))
+
+    def save(self, layer_keys, piece_keys=()):
+        """Writes the new results and pieces and evicts the stale ones
+
+        Entries are stale when their layer source is one of layer_keys or
+        piece_keys with a different state, or when they were not used for
+        max_age_days.
+        """
+        now = time()
+        connection = self.connect()
+        with self._lock, connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                [
+                    (line_key, layer_key, source, now, hits)
+                    for line_key, layer_key, source, hits in self._pending
+                ],
+            )
+            connection.executemany(
+                "UPDATE results SET used = ? WHERE line_key = ? AND layer_key = ?",
+                [(now, line_key, layer_key) for line_key, layer_key in self._used],
+            )
+            connection.executemany(
+                "DELETE FROM results WHERE layer_source = ? AND layer_key != ?",
+                [(source, key) for key, source in layer_keys],
+            )
+            connection.execute(
+                "DELETE FROM results WHERE used < ?", (now - self.max_age,)
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO pieces VALUES (?, ?, ?, ?, ?)",
+                [
+                    (piece_key, fid, source, now, wkb)
+                    for piece_key, fid, source, wkb in self._pending_pieces
+                ],
+            )
+            connection.executemany(
+                "UPDATE pieces SET used = ? WHERE layer_key = ?",
+                [(now, key) for key, _ in piece_keys],
+            )
+            connection.executemany(
+                "DELETE FROM pieces WHERE layer_source = ? AND layer_key != ?",
+                [(source, key) for key, source in piece_keys],
+            )
+            connection.execute(
+                "DELETE FROM pieces WHERE used < ?", (now - self.max_age,)
+            )
+            self._pending = []
+            self._pending_pieces = []
+            self._used = set()
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+        self._local = threading.local()
@@ -0,0 +1,121 @@
+"""checkpoint.py
+
+Checkpoints of chunked runs, so a run that crashed or was canceled can
+resume from its last finished batch of prospect lines
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from .cache import get_layer_stamp
+from .results import IntersectionResult
+
+CHECKPOINT_PREFIX = "line_analysis_"
+CHECKPOINT_SUFFIX = ".checkpoint"
+
+# functions
+
+
+def get_run_key(prospect_layer, layers, options) -> str:
+    """Hash of the prospect layer, the search layers and the options that
+    change the results of a run, a checkpoint only resumes the same run"""
+    stamp = [get_layer_stamp(prospect_layer)]
+    stamp += [get_layer_stamp(layer) for layer in layers]
+    stamp.append(options)
+    return hashlib.sha1(json.dumps(stamp, default=str).encode()).hexdigest()
+
+
+# Classes
+
+
+class Checkpoint:
+    """Results of the finished batches of a chunked run, in a file next to
+    the project
+
+    Each batch is appended and synced to disk as one JSON line, with the
+    number of lines it covers, the id of its last line and its results. A
+    torn line left by a crash is dropped when the file is loaded again.
+    """
+
+    def __init__(self, folder, run_key, resume=True):
+        name = f"{CHECKPOINT_PREFIX}{run_key[:16]}{CHECKPOINT_SUFFIX}"
+        self.filename = Path(folder) / name
+        self.run_key = run_key
+        self.resume = resume
+        self.batches = []
+        self._valid_size = 0
+        self._file = None
+
+    def load(self) -> list[tuple[int, int]]:
+        """Lines and last line id of the batches already finished, empty if
+        there is nothing to resume"""
+        self.batches = []
+        self._valid_size = 0
+        if not self.resume or not self.filename.exists():
+            return self.batches
+        with open(self.filename, "rb") as _file:
+            records = self.read(_file)
+            if next(records, None) != ["run", self.run_key]:
+                return self.batches
+            self._valid_size = _file.tell()
+            for _, lines, last_fid, _ in records:
+                self.batches.append((lines, last_fid))
+                self._valid_size = _file.tell()
+        return self.batches
+
+    def read(self, _file):
+        """Yields the records of the file, up to the first torn one"""
+        for line in iter(_file.readline, b""):
+            if not line.endswith(b"\n"):
+                return
+            try:
+                yield json.loads(line)
+            except ValueError:
+                return
+
+    def replay(self):
+        """Yields the results of each finished batch, one batch at a time"""
+        if not self.batches:
+            return
+        names = {}
+        with open(self.filename, "rb") as _file:
+            records = self.read(_file)
+            next(records)
+            for _, record in zip(self.batches, records):
+                yield [
+                    IntersectionResult.from_record(result, names)
+                    for result in record[3]
+                ]
+
+    def open(self):
+        """Starts appending batches, after the ones loaded or to a new file"""
+        if self.batches:
+            self._file = open(self.filename, "r+b")
+            self._file.truncate(self._valid_size)
+            self._file.seek(self._valid_size)
+        else:
+            self._file = open(self.filename, "wb")
+            self.write(("run", self.run_key))
+
+    def add(self, lines, last_fid, results):
+        self.batches.append((lines, last_fid))
+        self.write(
+            ("batch", lines, last_fid, [result.as_record() for result in results])
+        )
+
+    def write(self, record):
+        # values JSON has no type for, as the reports would write them
+        line = json.dumps(record, default=str) + "\n"
+        self._file.write(line.encode())
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self, finished=False):
+        """Closes the file, a finished run does not need it any more"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if finished:
+            self.filename.unlink(missing_ok=True)
@@ -3,10 +3,39 @@
 Script for checking intersection between lines
 """
 
+import cProfile
+from itertools import islice
+from time import monotonic, perf_counter
+
 from qgis.core import QgsVectorLayer
 from qgis.core import *
 
-from .tools import PLUGIN_NAME, filter_features
+from .cache import ResultCache, get_geometry_key, is_cacheable
+from .checkpoint import Checkpoint, get_run_key
+from . import vectorEngine
+from .results import IntersectionResult
+from .stats import RunStats
+from .tools import (
+    LOG_SUMMARY,
+    LOG_VERBOSE,
+    PLUGIN_NAME,
+    estimate_features,
+    filter_features,
+    get_attribute_converter,
+    get_feature_name,
+    get_geometry_engine,
+    get_id_request,
+    get_segment_envelopes,
+    get_selected_attributes,
+    join_pieces,
+    subdivide_geometry,
+    transform_extent,
+)
+
+# segments per quarter circle of the corridor buffers
+BUFFER_SEGMENTS = 8
+# candidates between progress updates inside a layer scan
+PROGRESS_STEP = 1024
 
 # Classes
 
@@ -19,91 +48,1072 @@ class CheckIntersections(QgsTask):
         layers: tuple[QgsVectorLayer.VectorLayer],
         prospect_layer: QgsVectorLayer.VectorLayer,
         layer_attr_map: dict[str, tuple[bool, dict[str, bool]]],
+        prepared: bool = True,
+        build_indexes: bool = True,
+        segment_length: float = 0,
+        parallel: bool = False,
+        stream=None,
+        verbosity: int = LOG_SUMMARY,
+        log_interval: float = 5,
+        cache: ResultCache = None,
+        vectorized: bool = False,
+        profile: bool = False,
+        keep_geometry: bool = False,
+        distances: dict[str, float] = None,
+        layer_major: bool = False,
+        max_vertices: int = 0,
+        chunk_size: int = 0,
+        checkpoint_folder=None,
+        resume: bool = True,
+        transform_context: QgsCoordinateTransformContext = None,
     ):
         super().__init__("Analysing Intersections")
         self.layers = layers
         self.prospect_layer = prospect_layer
         self.layer_attr_map = layer_attr_map
-        self.lines = tuple(filter_features(prospect_layer.getFeatures()))
-        self.total_features = self.get_total_work()
+        self.prepared = prepared
+        self.build_indexes = build_indexes
+        self.segment_length = segment_length
+        self.stream = stream
+        self.verbosity = verbosity
+        self.log_interval = log_interval
+        self.cache = cache
+        self.vectorized = vectorized
+        self.profile = profile
+        # the Shapely engine only returns measures, runs that
+        # keep the intersection geometries compute them all with QGIS
+        self.keep_geometry = keep_geometry
+        self.layer_major = layer_major
+        # search features with more vertices are cut in pieces of at most
+        # max_vertices, so exact tests only walk the pieces near each line
+        self.max_vertices = max_vertices
+        # chunked runs read the prospect lines in batches of chunk_size
+        # instead of keeping them all, and can checkpoint each batch
+        self.chunk_size = chunk_size
+        self.search_layers = tuple(
+            layer
+            for layer in layers
+            if layer_attr_map.get(layer.name(), (False, None))[0]
+        )
+        # corridor mode: features up to a distance of the lines, in units of
+        # the prospect layer CRS, are hits for the layers named in distances
+        self.distances = {
+            layer.id(): (distances or {}).get(layer.name(), 0)
+            for layer in self.search_layers
+            if (distances or {}).get(layer.name(), 0) > 0
+        }
+        # feature sources are created here, on the main thread, so the
+        # layers can be read safely from the task threads
+        self.sources = {
+            layer.id(): QgsVectorLayerFeatureSource(layer)
+            for layer in self.search_layers
+        }
+        self.fields = {layer.id(): layer.fields() for layer in self.search_layers}
+        self.attributes = {
+            layer.id(): tuple(get_selected_attributes(layer_attr_map, layer.name()))
+            for layer in self.search_layers
+        }
+        self.converters = {
+            layer.id(): get_attribute_converter(
+                self.fields[layer.id()], self.attributes[layer.id()]
+            )
+            for layer in self.search_layers
+        }
+        # only layers whose stamp changes with their data use the cache
+        self.layer_keys = {}
+        if cache is not None:
+            self.layer_keys = {
+                layer.id(): cache.get_layer_key(
+                    layer,
+                    self.attributes[layer.id()],
+                    self.distances.get(layer.id(), 0),
+                )
+                for layer in self.search_layers
+                if is_cacheable(layer)
+            }
+        self.piece_keys = {}
+        if cache is not None and max_vertices:
+            self.piece_keys = {
+                layer.id(): cache.get_piece_key(layer, max_vertices)
+                for layer in self.search_layers
+                if is_cacheable(layer)
+            }
+        # search layers in other CRS get the lines reprojected to their CRS,
+        # their extents are compared in the CRS of the prospect layer
+        context = transform_context
+        if context is None:
+            context = QgsProject.instance().transformContext()
+        crs = prospect_layer.crs()
+        self.layer_crs = {}
+        self.transforms = {}
+        for layer in self.search_layers:
+            if not crs.isValid() or not layer.crs().isValid() or layer.crs() == crs:
+                continue
+            key = layer.crs().authid() or layer.crs().toWkt()
+            self.layer_crs[layer.id()] = key
+            self.transforms[key] = (
+                QgsCoordinateTransform(crs, layer.crs(), context),
+                QgsCoordinateTransform(layer.crs(), crs, context),
+            )
+        # extents in the CRS of each layer, for the estimates of its queries
+        self.source_extents = {
+            layer.id(): (layer.extent(), max(layer.featureCount(), 0))
+            for layer in self.search_layers
+        }
+        self.extents = {}
+        for layer in self.search_layers:
+            transform = self.transforms.get(self.layer_crs.get(layer.id()))
+            self.extents[layer.id()] = (
+                transform_extent(layer.extent(), transform and transform[1]),
+                max(layer.featureCount(), 0),
+            )
+        self.unindexed = {
+            layer.id()
+            for layer in self.search_layers
+            if layer.hasSpatialIndex() == QgsFeatureSource.SpatialIndexNotPresent
+        }
+        self.checkpoint = None
+        if chunk_size:
+            self.lines = ()
+            self.prospect_source = QgsVectorLayerFeatureSource(prospect_layer)
+            self.prospect_count = max(prospect_layer.featureCount(), 1)
+            if checkpoint_folder is not None:
+                run_key = get_run_key(
+                    prospect_layer,
+                    self.search_layers,
+                    [
+                        self.attributes,
+                        self.distances,
+                        segment_length,
+                        keep_geometry,
+                        chunk_size,
+                    ],
+                )
+                self.checkpoint = Checkpoint(checkpoint_folder, run_key, resume)
+        else:
+            self.lines = tuple(filter_features(prospect_layer.getFeatures()))
+        self.subtasks = []
+        # streamed results are written in order as they are found, so
+        # they are not split in subtasks
+        # cProfile only sees the thread it runs on, profiled runs stay serial
+        if (
+            parallel
+            and stream is None
+            and not profile
+            and not chunk_size
+            and len(self.search_layers) > 1
+        ):
+            for layer in self.search_layers:
+                subtask = CheckLayerIntersections(self, layer)
+                self.subtasks.append(subtask)
+                self.addSubTask(
+                    subtask, subTaskDependency=QgsTask.ParentDependsOnSubTask
+                )
+        self.reset()
+
+    def reset(self):
+        """Clears the state of a previous run"""
+        self.indexes = {}
+        self.precomputed = {}
+        self.pieces = {}
+        self.line_geometries = {}
+        self.line_work = {}
+        self.total_work = 0
+        self.work_done = 0
         self.current_features_done = 0
+        self.progress_offset = 0
+        self.progress_share = 100
+        self.stats = RunStats()
+        self.last_progress = 0
+        self.last_log = monotonic()
         self.results = []
 
+    def prepare(self):
+        """Sets up the progress estimates, reprojected lines and spatial
+        indexes for a run"""
+        self.prepare_lines()
+        with self.stats.timer("index"):
+            self.indexes = self.get_spatial_indexes()
+
+    def prepare_lines(self):
+        """Sets up everything that depends on the lines, once per batch in
+        chunked runs"""
+        with self.stats.timer("reproject"):
+            self.line_geometries = self.get_line_geometries()
+        self.line_work = self.get_total_work(self.search_layers)
+        self.total_work = sum(self.line_work.values()) or 1
+        self.precomputed = {}
+        if self.vectorized and not self.keep_geometry:
+            with self.stats.timer("vectorized"):
+                self.precomputed = self.get_vectorized_hits()
+        self.scanned = {}
+        if self.layer_major:
+            self.scanned = self.get_layer_major_results()
+
     def run(self):
-        self.results = []
-        self.current_features_done = 0
+        self.reset()
+        if self.profile:
+            self.stats.profiler = cProfile.Profile()
+            self.stats.profiler.enable()
         QgsMessageLog.logMessage(
             "-" * 50
             + f"\nSearching collisions for layer: {self.prospect_layer.name()}",
             PLUGIN_NAME,
             level=Qgis.MessageLevel.Success,
         )
-        for line in self.lines:
-            self.results += self.check_intersections(line)
+        if self.subtasks:
+            self.merge_subtasks()
+        elif self.chunk_size:
+            if not self.run_chunks():
+                self.finish(canceled=True)
+                return False
+        else:
+            self.prepare()
+            if self.stream is not None:
+                self.stream.open()
+            for line in self.lines:
+                results = self.check_intersections(line)
+                if results is False:
+                    self.finish(canceled=True)
+                    return False
+                if self.stream is not None:
+                    with self.stats.timer("write"):
+                        for result in results:
+                            self.stream.write(result)
+                else:
+                    self.results += results
+        self.finish()
+        self.log_summary(force=True)
+        if self.stats.get("skipped_pairs"):
+            self.log(
+                f">Extent pre-filter skipped {self.stats.get('skipped_pairs')} "
+                "line/layer pairs"
+            )
+        if self.segment_length:
+            self.log(
+                f">Segment filtering kept "
+                f"{self.stats.get('segment_candidates')} candidates, of about "
+                f"{self.stats.get('bbox_candidates')} in the bounding boxes"
+            )
         QgsMessageLog.logMessage(
             f">Finished!\n" + "-" * 50, PLUGIN_NAME, level=Qgis.MessageLevel.Success
         )
         return True
 
-    def get_total_work(self) -> int:
-        """Get totals of features to check"""
-        i = 0
+    def run_chunks(self) -> bool:
+        """Checks the prospect lines in batches of chunk_size read straight
+        from the provider
+
+        With a checkpoint, the results of each finished batch are saved, and
+        the batches finished by a previous run are replayed from it instead
+        of checked again.
+        """
+        done = []
+        if self.checkpoint is not None:
+            done = self.checkpoint.load()
+        if self.stream is not None:
+            self.stream.open()
+        features = filter_features(self.prospect_source.getFeatures())
+        lines_done = sum(lines for lines, _ in done)
+        if done:
+            skipped = list(islice(features, lines_done - 1, lines_done))
+            if not skipped or skipped[0].id() != done[-1][1]:
+                # the provider did not return the lines in the same order
+                self.log(
+                    "->The prospect layer changed order, checking it again",
+                    level=Qgis.MessageLevel.Warning,
+                )
+                done = self.checkpoint.batches = []
+                lines_done = 0
+                features = filter_features(self.prospect_source.getFeatures())
+            else:
+                for results in self.checkpoint.replay():
+                    self.add_results(results)
+                self.log(f"->Resumed after {lines_done} lines checked before")
+        if self.checkpoint is not None:
+            self.checkpoint.open()
+        prepared = False
+        while True:
+            self.lines = tuple(islice(features, self.chunk_size))
+            if not self.lines:
+                break
+            self.work_done = 0
+            self.progress_offset = lines_done * 100 / self.prospect_count
+            self.progress_share = len(self.lines) * 100 / self.prospect_count
+            if prepared:
+                self.prepare_lines()
+            else:
+                self.prepare()
+                prepared = True
+            batch_results = []
+            for line in self.lines:
+                results = self.check_intersections(line)
+                if results is False:
+                    return False
+                batch_results += results
+            self.add_results(batch_results)
+            # the new cache entries are written per batch, not kept until the
+            # end of the run
+            if self.cache is not None:
+                self.cache.save(self.layer_keys.values(), self.piece_keys.values())
+            if self.checkpoint is not None:
+                self.checkpoint.add(len(self.lines), self.lines[-1].id(), batch_results)
+            lines_done += len(self.lines)
+        self.lines = ()
+        return True
+
+    def add_results(self, results):
+        """Writes results to the output stream, or keeps them"""
+        if self.stream is not None:
+            with self.stats.timer("write"):
+                for result in results:
+                    self.stream.write(result)
+        else:
+            self.results += results
+
+    def finish(self, canceled=False):
+        """Closes the output stream and saves the cache, also for canceled
+        runs since the lines already checked are still valid"""
+        if self.stats.profiler is not None:
+            self.stats.profiler.disable()
+        if self.stream is not None:
+            with self.stats.timer("write"):
+                self.stream.close(discard=canceled)
+            if not canceled:
+                self.stats.count("rows_written", self.stream.rows)
+                self.stats.count("bytes_written", self.stream.bytes_written)
+                self.stats.save(self.stream.filename)
+        if self.cache is not None:
+            self.cache.save(self.layer_keys.values(), self.piece_keys.values())
+            self.cache.close()
+            self.log(
+                f">Cache: {self.cache.hits} line/layer pairs reused, "
+                f"{self.cache.misses} computed"
+            )
+        if self.checkpoint is not None:
+            self.checkpoint.close(finished=not canceled)
+
+    def merge_subtasks(self):
+        """Joins the results of the per layer subtasks in the same order as
+        a serial run: by prospect line, then by search layer"""
+        for subtask in self.subtasks:
+            self.current_features_done += subtask.current_features_done
+            self.stats.merge(subtask.stats)
+        for line in self.lines:
+            for subtask in self.subtasks:
+                self.results += subtask.line_results.get(line.id(), [])
+        self.setProgress(100)
+
+    def get_line_geometries(self) -> dict[str, dict[int, QgsGeometry]]:
+        """The lines reprojected once to each CRS of the search layers"""
+        line_geometries = {}
+        keys = {self.layer_crs.get(layer.id()) for layer in self.search_layers}
+        keys.discard(None)
+        for key in keys:
+            transform = self.transforms[key][0]
+            geometries = line_geometries[key] = {}
+            for line in self.lines:
+                geometry = line.geometry()
+                try:
+                    geometry.transform(transform)
+                except QgsCsException as err:
+                    self.log(
+                        f"->Line {line.id()} can not be reprojected to {key}: {err}",
+                        level=Qgis.MessageLevel.Warning,
+                    )
+                    geometry = QgsGeometry()
+                geometries[line.id()] = geometry
+        return line_geometries
+
+    def get_layer_geometry(self, layer, line, geometries):
+        """The geometry of line in the CRS of layer, the geometry features are
+        tested against and its prepared engine
+
+        The tested geometry is the line itself, or in corridor mode the line
+        buffered by the distance of the layer. geometries holds the ones of
+        the current line by CRS and distance, so each is only buffered and
+        prepared once per line.
+        """
+        crs_key = self.layer_crs.get(layer.id())
+        key = (crs_key, self.distances.get(layer.id(), 0))
+        if key not in geometries:
+            line_geometry = geometries[(None, 0)][0]
+            if crs_key is not None:
+                line_geometry = self.line_geometries[crs_key][line.id()]
+            geometry = line_geometry
+            if key[1]:
+                geometry = geometries[(None, 0)][0].buffer(key[1], BUFFER_SEGMENTS)
+                if crs_key is not None:
+                    try:
+                        geometry.transform(self.transforms[crs_key][0])
+                    except QgsCsException:
+                        geometry = QgsGeometry()
+            engine = None
+            if self.prepared and not geometry.isNull():
+                engine = get_geometry_engine(geometry)
+            geometries[key] = (line_geometry, geometry, engine)
+        return geometries[key]
+
+    def get_total_work(self, layers) -> dict[int, int]:
+        """Estimates the features of layers to check per line, without
+        querying the layers
+
+        The feature count of each layer is scaled by the part of its extent
+        covered by the bounding box of the line, the real counts refine the
+        progress as the scan goes.
+        """
+        layers = [self.extents[layer.id()] for layer in layers]
+        line_work = {}
         for line in self.lines:
-            for layer in self.layers:
-                for feat in layer.getFeatures(line.geometry().boundingBox()):
-                    i += 1
-        return i
+            bbox = line.geometry().boundingBox()
+            line_work[line.id()] = sum(
+                estimate_features(bbox, extent, count) + 1 for extent, count in layers
+            )
+        return line_work
+
+    def get_vectorized_hits(self) -> dict[str, dict[int, list[tuple]]]:
+        """Runs the intersections of the layers in the prospect CRS with the
+        Shapely engine
+
+        Every layer is read once over the extent of all the lines and its
+        geometries are checked at once against the lines.
+        """
+        if not vectorEngine.is_available():
+            self.log(
+                "->Shapely 2 and NumPy are not installed, "
+                "using the QGIS geometry engine",
+                level=Qgis.MessageLevel.Warning,
+            )
+            return {}
+        if not self.lines:
+            return {}
+        bbox = QgsRectangle(self.lines[0].geometry().boundingBox())
+        for line in self.lines[1:]:
+            bbox.combineExtentWith(line.geometry().boundingBox())
+        prospect_ids, prospect_wkb = vectorEngine.export_wkb(self.lines)
+        vectorized = {}
+        for layer in self.search_layers:
+            if (
+                layer.id() in self.layer_crs
+                or layer.id() in self.distances
+                or self.isCanceled()
+            ):
+                continue
+            fids, search_wkb = vectorEngine.export_wkb(
+                self.sources[layer.id()].getFeatures(
+                    QgsFeatureRequest(bbox).setNoAttributes()
+                )
+            )
+            vectorized[layer.id()] = vectorEngine.get_hits(
+                prospect_ids, prospect_wkb, fids, search_wkb
+            )
+            self.log(f"->Layer {layer.name()}: intersections computed with Shapely")
+        return vectorized
+
+    def get_layer_major_results(self) -> dict[str, dict[int, list]]:
+        """Checks the layers not computed elsewhere reading each one once for
+        all the lines, instead of once per line
+
+        Returns the results by layer id and line id, ordered by feature id
+        as the line by line scan gives them.
+        """
+        scanned = {}
+        for layer in self.search_layers:
+            if layer.id() in self.precomputed or self.isCanceled():
+                continue
+            # the work of the layer is done here instead of line by line
+            layer_work = self.get_total_work((layer,))
+            for line_id, work in layer_work.items():
+                self.line_work[line_id] -= work
+            work = sum(layer_work.values())
+            with self.stats.timer("scan", layer.name()):
+                scanned[layer.id()] = self.scan_layer(layer, work)
+            self.work_done += work
+            self.log(f"->Layer {layer.name()}: read once for all the lines")
+        return scanned
+
+    def scan_layer(self, layer, work=0) -> dict[int, list[IntersectionResult]]:
+        """Streams the features of layer over the extent of all the lines and
+        tests each one against the lines whose bounding box it touches, found
+        with a spatial index of the lines
 
-    def check_intersections(self, line) -> list[dict]:
+        work is the estimate of the line/feature tests, for the progress.
+        """
+        layer_name = layer.name()
+        index = QgsSpatialIndex()
+        lines = {}
+        extent = None
+        for i, line in enumerate(self.lines):
+            line_geometry = line.geometry()
+            geometries = {(None, 0): (line_geometry, line_geometry, None)}
+            _, geometry, engine = self.get_layer_geometry(layer, line, geometries)
+            if geometry.isNull():
+                continue
+            if engine is None and self.prepared:
+                engine = get_geometry_engine(geometry)
+            bbox = geometry.boundingBox()
+            index.addFeature(i, bbox)
+            if extent is None:
+                extent = QgsRectangle(bbox)
+            else:
+                extent.combineExtentWith(bbox)
+            lines[i] = (line, get_feature_name(line), line_geometry, geometry, engine)
+        results = {}
+        if extent is None:
+            return results
+        request = QgsFeatureRequest(extent)
+        names = self.attributes[layer.id()]
+        if names:
+            request.setSubsetOfAttributes(names, self.fields[layer.id()])
+        else:
+            request.setNoAttributes()
+        convert = self.converters[layer.id()]
+        tests = hits = 0
+        times = [0, 0, 0, 0]
+        loop_start = perf_counter()
+        for feat in self.sources[layer.id()].getFeatures(request):
+            if self.isCanceled():
+                return results
+            values = None
+            for i in index.intersects(feat.geometry().boundingBox()):
+                line, line_name, line_geometry, geometry, engine = lines[i]
+                hit = self.test_candidate(
+                    layer, feat, line_geometry, geometry, engine, times
+                )
+                tests += 1
+                if not tests % PROGRESS_STEP:
+                    self.update_progress(
+                        (self.work_done + min(tests, work)) * 100 / self.total_work
+                    )
+                if hit is None:
+                    continue
+                if values is None:
+                    start = perf_counter()
+                    values = convert(feat)
+                    times[3] += perf_counter() - start
+                results.setdefault(line.id(), []).append(
+                    self.get_result(line, line_name, layer, hit, values)
+                )
+                hits += 1
+        self.add_loop_times(layer_name, perf_counter() - loop_start, times)
+        self.stats.count("candidates", tests, layer_name)
+        self.stats.count("exact_tests", tests, layer_name)
+        self.stats.count("hits", hits, layer_name)
+        for line_results in results.values():
+            line_results.sort(key=lambda result: result.feature_id)
+        return results
+
+    def get_spatial_indexes(self) -> dict[str, QgsSpatialIndex]:
+        """Builds an in-memory spatial index for layers without a usable one
+
+        Without an index every bounding box query is a full scan of the layer,
+        so those layers are streamed once into a QgsSpatialIndex that keeps
+        the geometries and answers the queries of every line.
+        """
+        indexes = {}
+        for layer in self.search_layers:
+            if layer.id() in self.precomputed or layer.id() in self.scanned:
+                continue
+            if not self.build_indexes or layer.id() not in self.unindexed:
+                self.log(f"->Layer {layer.name()}: using provider queries")
+                continue
+            source = self.sources[layer.id()]
+            indexes[layer.id()] = QgsSpatialIndex(
+                source.getFeatures(QgsFeatureRequest().setNoAttributes()),
+                flags=QgsSpatialIndex.FlagStoreFeatureGeometries,
+            )
+            self.log(
+                f"->Layer {layer.name()}: no spatial index, "
+                "using an in-memory index built for this run"
+            )
+        return indexes
+
+    def get_candidates(self, layer, geometry, distance=0, line_geometry=None):
+        """Yields the features of layer whose bounding box touches geometry,
+        or is at most distance away from it
+
+        With a segment_length, only the features touching the boxes of the
+        segments of line_geometry, the line in the prospect CRS, are fetched.
+        Only the ids and geometries are fetched, use get_hit_features to get
+        the attributes of the features that intersect.
+        """
+        bbox = geometry.boundingBox().buffered(distance)
+        source = self.sources[layer.id()]
+        index = self.indexes.get(layer.id())
+        envelopes = None
+        if self.segment_length and line_geometry is not None:
+            envelopes = self.get_layer_envelopes(layer, line_geometry)
+        if envelopes:
+            fids = self.get_envelope_candidates(layer, index, bbox, envelopes)
+            if index is None:
+                if fids:
+                    yield from source.getFeatures(
+                        QgsFeatureRequest().setFilterFids(fids).setNoAttributes()
+                    )
+                return
+        elif index is None:
+            yield from source.getFeatures(QgsFeatureRequest(bbox).setNoAttributes())
+            return
+        else:
+            fids = index.intersects(bbox)
+        for fid in sorted(fids):
+            feat = QgsFeature(fid)
+            feat.setGeometry(index.geometry(fid))
+            yield feat
+
+    def get_layer_envelopes(self, layer, line_geometry) -> list[QgsRectangle]:
+        """Boxes of the segments of a line in the CRS of layer, None if they
+        can not be reprojected
+
+        The line is split in the prospect CRS, where segment_length and the
+        corridor distance are given, and each box is reprojected after.
+        """
+        distance = self.distances.get(layer.id(), 0)
+        transform = self.transforms.get(self.layer_crs.get(layer.id()))
+        envelopes = []
+        for envelope in get_segment_envelopes(line_geometry, self.segment_length):
+            envelope = transform_extent(
+                envelope.buffered(distance), transform and transform[0]
+            )
+            if envelope is None:
+                return None
+            envelopes.append(envelope)
+        return envelopes
+
+    def get_envelope_candidates(self, layer, index, bbox, envelopes) -> list[int]:
+        """Ids of the features touching any of the envelopes, without repeats
+
+        Also counts how many features the single bounding box would have
+        returned, to report the candidates pruned. Without an in-memory index
+        that count is estimated from the layer extent, querying it would run
+        the query the envelopes are there to avoid.
+        """
+        fids = set()
+        if index is None:
+            source = self.sources[layer.id()]
+            for envelope in envelopes:
+                fids.update(
+                    feat.id() for feat in source.getFeatures(get_id_request(envelope))
+                )
+            bbox_candidates = estimate_features(bbox, *self.source_extents[layer.id()])
+        else:
+            for envelope in envelopes:
+                fids.update(index.intersects(envelope))
+            bbox_candidates = len(index.intersects(bbox))
+        self.stats.count("bbox_candidates", bbox_candidates)
+        self.stats.count("segment_candidates", len(fids))
+        return sorted(fids)
+
+    def get_hit_features(self, layer, hits):
+        """Fetches the features that intersect, with only the attributes
+        selected on layer_attr_map and without geometry
+
+        hits is a list of hits as test_candidate returns them, yields
+        (feature, hit) in the same order.
+        """
+        if not hits:
+            return
+        request = (
+            QgsFeatureRequest()
+            .setFilterFids([hit[0] for hit in hits])
+            .setFlags(QgsFeatureRequest.NoGeometry)
+        )
+        attributes = self.attributes[layer.id()]
+        if attributes:
+            request.setSubsetOfAttributes(attributes, self.fields[layer.id()])
+        else:
+            request.setNoAttributes()
+        features = {
+            feat.id(): feat for feat in self.sources[layer.id()].getFeatures(request)
+        }
+        for hit in hits:
+            yield features.get(hit[0], QgsFeature(hit[0])), hit
+
+    def check_intersections(self, line) -> list[IntersectionResult]:
         """Checks intersections on a feature from other layers"""
         results = []
-        QgsMessageLog.logMessage(
-            f"-> Analising Feature with ID: {line.id()}", PLUGIN_NAME
-        )
-        for layer in self.layers:
-            if not self.layer_attr_map.get(layer.name(), (False, None))[0]:
+        if self.verbosity >= LOG_VERBOSE:
+            self.log(f"-> Analising Feature with ID: {line.id()}", LOG_VERBOSE)
+        line_geometry = line.geometry()
+        line_name = get_feature_name(line)
+        line_key = None
+        if self.cache is not None:
+            line_key = get_geometry_key(line_geometry)
+        engine = get_geometry_engine(line_geometry) if self.prepared else None
+        geometries = {(None, 0): (line_geometry, line_geometry, engine)}
+        line_work = self.line_work.get(line.id(), 0)
+        line_features_done = 0
+        for i, layer in enumerate(self.search_layers):
+            # layers read by the Shapely engine, the cache or a layer scan have no
+            # candidates to count, the progress also moves layer by layer
+            self.update_progress(
+                (self.work_done + line_work * i / len(self.search_layers))
+                * 100
+                / self.total_work
+            )
+            if self.isCanceled():
+                return False
+            layer_name = layer.name()
+            if self.verbosity >= LOG_VERBOSE:
+                self.log(f"->Checking layer: {layer_name}", LOG_VERBOSE)
+            extent = self.extents[layer.id()][0]
+            distance = self.distances.get(layer.id(), 0)
+            if extent is not None and not line_geometry.boundingBox().buffered(
+                distance
+            ).intersects(extent):
+                self.stats.count("skipped_pairs", 1, layer_name)
                 continue
-            QgsMessageLog.logMessage(f"->Checking layer: {layer.name()}", PLUGIN_NAME)
-            for feat in layer.getFeatures(line.geometry().boundingBox()):
-                self.current_features_done += 1
-                self.setProgress(
-                    self.current_features_done * 100 // self.total_features
+            convert = self.converters[layer.id()]
+            layer_key = self.layer_keys.get(layer.id())
+            cached = None
+            if layer_key is not None and not self.keep_geometry:
+                cached = self.cache.get(line_key, layer_key)
+            layer_results = []
+            hits = []
+            layer_features_done = line_features_done
+            if cached is not None:
+                # the cache keeps the measures only, the attributes are read
+                # again so they are never older than the layer
+                hits = [
+                    (fid, points, length, area, None, hit_distance)
+                    for fid, points, length, area, hit_distance in cached
+                ]
+                candidates = ()
+                self.stats.count("cached_pairs", 1, layer_name)
+            elif layer.id() in self.scanned:
+                layer_results = self.scanned[layer.id()].pop(line.id(), [])
+                candidates = ()
+            elif layer.id() in self.precomputed:
+                hits = [
+                    (*hit, None, None)
+                    for hit in self.precomputed[layer.id()].pop(line.id(), [])
+                ]
+                candidates = ()
+            else:
+                layer_line, geometry, layer_engine = self.get_layer_geometry(
+                    layer, line, geometries
                 )
-                if self.isCanceled():
-                    return False
-                if feat.geometry().intersects(line.geometry()):
-                    points, length, area = self.analyse_intersections(feat, line)
-                    results.append(
-                        {
-                            "prospect_layer": self.prospect_layer,
-                            "prospect_feature": line,
-                            "layer": layer,
-                            "feature": feat,
-                            "intersections": points,
-                            "length": length,
-                            "area": area,
-                        }
+                transform = self.transforms.get(self.layer_crs.get(layer.id()))
+                # the distance is in the prospect CRS, candidates of layers in
+                # other CRS come from the bounding box of the reprojected buffer
+                if distance and transform:
+                    candidates = self.get_candidates(
+                        layer, geometry, line_geometry=line_geometry
                     )
-                    QgsMessageLog.logMessage(
-                        f"layer: {layer.name()} - No intersections: {points} - Feature ID: {feat.id()}",
-                        PLUGIN_NAME,
-                        Qgis.MessageLevel.Info,
+                else:
+                    candidates = self.get_candidates(
+                        layer, layer_line, distance, line_geometry
                     )
+            times = [0, 0, 0, 0]
+            loop_start = perf_counter()
+            for feat in candidates:
+                line_features_done += 1
+                if not line_features_done % PROGRESS_STEP:
+                    self.update_progress(
+                        (self.work_done + min(line_features_done, line_work))
+                        * 100
+                        / self.total_work
+                    )
+                    if self.isCanceled():
+                        return False
+                hit = self.test_candidate(
+                    layer, feat, line_geometry, geometry, layer_engine, times
+                )
+                if hit is not None:
+                    hits.append(hit)
+            layer_candidates = line_features_done - layer_features_done
+            if layer_candidates:
+                self.add_loop_times(layer_name, perf_counter() - loop_start, times)
+                self.stats.count("exact_tests", layer_candidates, layer_name)
+            hit_features = self.stats.timed(
+                self.get_hit_features(layer, hits), "attributes", layer_name
+            )
+            convert_time = 0
+            for feat, hit in hit_features:
+                start = perf_counter()
+                values = convert(feat)
+                convert_time += perf_counter() - start
+                layer_results.append(
+                    self.get_result(line, line_name, layer, hit, values)
+                )
+                if self.verbosity >= LOG_VERBOSE:
+                    self.log(
+                        f"layer: {layer.name()} - No intersections: {hit[1]}"
+                        f" - Feature ID: {feat.id()}",
+                        LOG_VERBOSE,
+                    )
+            if hits:
+                self.stats.add_time("convert", convert_time, layer_name)
+            if layer_key is not None and cached is None:
+                self.cache.put(
+                    line_key,
+                    layer_key,
+                    [
+                        (
+                            result.feature_id,
+                            result.intersections,
+                            result.length,
+                            result.area,
+                            result.distance,
+                        )
+                        for result in layer_results
+                    ],
+                )
+            results += layer_results
+            self.stats.count("candidates", layer_candidates, layer_name)
+            self.stats.count("hits", len(hits), layer_name)
+            self.log_summary()
+        self.current_features_done += line_features_done
+        self.work_done += line_work
+        self.update_progress(self.work_done * 100 / self.total_work)
         return results
 
-    def analyse_intersections(self, feat, line):
-        """Returns the length, area and number of intersections of feat and line"""
-        intersection = feat.geometry().intersection(line.geometry())
-        int_type = QgsWkbTypes.displayString(intersection.wkbType())
+    def test_candidate(self, layer, feat, line_geometry, geometry, engine, times):
+        """Exact test of a candidate of layer against the geometry tested for
+        a line, shared by the line by line and the layer-major scans
+
+        Returns None if they do not intersect, else the hit as (feature id,
+        intersections, length, area, intersection WKB, distance), the WKB
+        only when keep_geometry and the distance only in corridor mode.
+        times holds the seconds of the intersects tests, the intersections,
+        the subdivisions and the attribute conversions of the loop, this adds
+        to the first three as it goes.
+        """
+        pieces = None
+        if self.max_vertices:
+            pieces = self.get_near_pieces(layer, feat, geometry, times)
+        start = perf_counter()
+        if pieces is not None:
+            hit = self.pieces_intersect(pieces, geometry, engine)
+        elif engine is not None:
+            hit = engine.intersects(feat.geometry().constGet())
+        else:
+            hit = feat.geometry().intersects(geometry)
+        tested = perf_counter()
+        times[0] += tested - start
+        if not hit:
+            return None
+        transform = self.transforms.get(self.layer_crs.get(layer.id()))
+        to_prospect = transform[1] if transform else None
+        intersection = self.get_intersection(
+            feat, geometry, engine, to_prospect, pieces
+        )
+        hit = (
+            feat.id(),
+            *self.measure_intersection(intersection),
+            bytes(intersection.asWkb()) if self.keep_geometry else None,
+            (
+                self.get_distance(feat, line_geometry, to_prospect)
+                if layer.id() in self.distances
+                else None
+            ),
+        )
+        times[1] += perf_counter() - tested
+        return hit
+
+    def get_result(self, line, line_name, layer, hit, values) -> IntersectionResult:
+        """Result of a hit of line on layer, as test_candidate returns them"""
+        fid, points, length, area, geometry, distance = hit
+        return IntersectionResult(
+            line.id(),
+            line_name,
+            layer.name(),
+            fid,
+            points,
+            length,
+            area,
+            self.attributes[layer.id()],
+            values,
+            geometry,
+            distance,
+        )
+
+    def add_loop_times(self, layer_name, elapsed, times):
+        """Adds the times of a loop over the candidates of a layer
+
+        Timing every candidate costs as much as a prepared test, so the loop
+        sums its times locally and the time reading the candidates is the
+        rest of the loop. The subdivisions are already in their own timer.
+        """
+        intersects, intersection, _, convert = times
+        self.stats.add_time("fetch", elapsed - sum(times), layer_name)
+        self.stats.add_time("intersects", intersects, layer_name)
+        self.stats.add_time("intersection", intersection, layer_name)
+        if convert:
+            self.stats.add_time("convert", convert, layer_name)
+
+    def log(self, message, verbosity=LOG_SUMMARY, level=Qgis.MessageLevel.Info):
+        """Logs message if the task verbosity allows it"""
+        if self.verbosity >= verbosity:
+            QgsMessageLog.logMessage(message, PLUGIN_NAME, level)
+
+    def log_summary(self, force=False):
+        """Logs the candidates and hits per layer, at most every log_interval
+        seconds"""
+        if self.verbosity < LOG_SUMMARY:
+            return
+        if not force and monotonic() - self.last_log < self.log_interval:
+            return
+        self.last_log = monotonic()
+        self.log(
+            "\n".join(
+                f"->Layer {name}: {self.stats.get('candidates', name)} candidates"
+                f" checked, {self.stats.get('hits', name)} hits"
+                for name in (layer.name() for layer in self.search_layers)
+            )
+        )
+
+    def update_progress(self, progress):
+        """Sends the progress only when it moved a whole percent, to not flood
+        the main thread with signals"""
+        progress = self.progress_offset + progress * self.progress_share / 100
+        if progress - self.last_progress >= 1 or progress >= 100:
+            self.last_progress = progress
+            self.setProgress(progress)
+
+    def get_intersection(
+        self, feat, line_geometry, engine=None, transform=None, pieces=None
+    ):
+        """Intersection of feat and line, in the CRS of the prospect layer
+
+        If a prepared engine of the line is given, it is reused for the
+        intersection instead of setting up a new one for every feature. If
+        the layer of feat is in another CRS, transform takes the intersection
+        to the CRS of the prospect layer. For a subdivided feature, pieces
+        are the ones near the line and their intersections are joined.
+        """
+        if pieces is not None:
+            intersection = join_pieces(
+                [
+                    (
+                        QgsGeometry(engine.intersection(piece.constGet()))
+                        if engine is not None
+                        else piece.intersection(line_geometry)
+                    )
+                    for piece in pieces
+                ]
+            )
+        elif engine is not None:
+            intersection = QgsGeometry(engine.intersection(feat.geometry().constGet()))
+        else:
+            intersection = feat.geometry().intersection(line_geometry)
+        if transform is not None:
+            try:
+                intersection.transform(transform)
+            except QgsCsException as err:
+                self.log(
+                    f"->Intersection with feature {feat.id()} can not be "
+                    f"reprojected: {err}",
+                    level=Qgis.MessageLevel.Warning,
+                )
+        return intersection
+
+    def get_near_pieces(self, layer, feat, geometry, times=None):
+        """Pieces of a feature with more than max_vertices whose bounding box
+        touches geometry, None for the other features
+
+        The pieces are made once per run, or read from the cache, and kept
+        with a spatial index of their bounding boxes. The time making them is
+        also added to times[2] when given.
+        """
+        key = (layer.id(), feat.id())
+        if key not in self.pieces:
+            feat_geometry = feat.geometry()
+            if (
+                feat_geometry.isNull()
+                or feat_geometry.constGet().nCoordinates() <= self.max_vertices
+            ):
+                return None
+            start = perf_counter()
+            self.pieces[key] = self.get_pieces(layer, feat_geometry, feat.id())
+            seconds = perf_counter() - start
+            self.stats.add_time("subdivide", seconds, layer.name())
+            if times is not None:
+                times[2] += seconds
+            self.stats.count("subdivided", 1, layer.name())
+        index, pieces = self.pieces[key]
+        return [pieces[i] for i in index.intersects(geometry.boundingBox())]
+
+    def get_pieces(self, layer, geometry, fid):
+        """Spatial index and pieces of a subdivided feature geometry"""
+        piece_key = self.piece_keys.get(layer.id())
+        wkbs = None
+        if piece_key is not None:
+            wkbs = self.cache.get_pieces(piece_key, fid)
+        if wkbs is None:
+            wkbs = subdivide_geometry(geometry, self.max_vertices)
+            if piece_key is not None:
+                self.cache.put_pieces(piece_key, fid, wkbs)
+        index = QgsSpatialIndex()
+        pieces = []
+        for i, wkb in enumerate(wkbs):
+            piece = QgsGeometry()
+            piece.fromWkb(wkb)
+            index.addFeature(i, piece.boundingBox())
+            pieces.append(piece)
+        return index, pieces
+
+    def pieces_intersect(self, pieces, geometry, engine=None):
+        """If any of the pieces of a subdivided feature touches geometry"""
+        if engine is not None:
+            return any(engine.intersects(piece.constGet()) for piece in pieces)
+        return any(piece.intersects(geometry) for piece in pieces)
+
+    def get_distance(self, feat, line_geometry, transform=None):
+        """Distance from feat to the line, in the CRS of the prospect layer"""
+        geometry = feat.geometry()
+        if transform is not None:
+            try:
+                geometry.transform(transform)
+            except QgsCsException:
+                return None
+        return round(geometry.distance(line_geometry), 3)
+
+    def measure_intersection(self, intersection):
+        """Returns the number of intersections, length and area of an
+        intersection"""
+        int_type = QgsWkbTypes.geometryType(intersection.wkbType())
         points = 1
         length = 0
         area = 0
-        if "Polygon" in int_type:
+        if int_type == QgsWkbTypes.PolygonGeometry:
             points = len(intersection.asGeometryCollection())
             area = intersection.area()
-        if "Line" in int_type:
+        elif int_type == QgsWkbTypes.LineGeometry:
             points = len(intersection.asGeometryCollection())
             length = intersection.length()
-        elif "Point" in int_type:
+        elif int_type == QgsWkbTypes.PointGeometry:
             points = len(list(intersection.vertices()))
         return points, round(length, 3), round(area, 4)
+
+
+class CheckLayerIntersections(CheckIntersections):
+    """Subtask of CheckIntersections that analyses a single search layer
+
+    Shares the lines and feature sources of the main task, and keeps its
+    results per prospect line so the main task can merge them in order.
+    """
+
+    def __init__(self, analysis: CheckIntersections, layer: QgsVectorLayer):
+        QgsTask.__init__(self, f"Analysing Intersections on {layer.name()}")
+        # every setting and prepared input of the main task is shared, so
+        # new ones need no copy here, only the run state is its own
+        self.__dict__.update(vars(analysis))
+        self.search_layers = (layer,)
+        self.stream = None
+        self.profile = False
+        self.checkpoint = None
+        self.subtasks = []
+        self.line_results = {}
+        self.reset()
+
+    def run(self):
+        self.reset()
+        self.line_results = {}
+        self.prepare()
+        for line in self.lines:
+            results = self.check_intersections(line)
+            if results is False:
+                return False
+            self.line_results[line.id()] = results
+        return True
@@ -1,19 +1,21 @@
 """LineAnalysis main entry point for setting up the UI, Processing."""
 
-from pathlib import Path
 import json
+from pathlib import Path
 
-from qgis.core import *
-from qgis.PyQt import uic
-from qgis.PyQt.QtCore import QSize, Qt
-from qgis.PyQt.QtGui import *
-from qgis.PyQt.QtWidgets import *
-from qgis.PyQt.QtWidgets import QAction, QDialog
+from qgis.core import Qgis, QgsApplication, QgsProject, QgsVectorLayer
+from qgis.PyQt.QtGui import QIcon
+from qgis.PyQt.QtWidgets import QAction
 
-from .lineAnalysis import CheckIntersections
-from .outputWriter import WriteCSVTask
-from .pluginUI import LayerSelectionDialog, LayerSelectionTree
-from .tools import PLUGIN_NAME, filter_search_layers, get_prospect_layer, plugin_path
+from .processingProvider import LineAnalysisProvider
+from .tools import (
+    LOG_SUMMARY,
+    PLUGIN_NAME,
+    filter_search_layers,
+    get_prospect_layer,
+    get_setting,
+    plugin_path,
+)
 
 # main class
 
@@ -51,12 +53,32 @@ class lineAnalisisPlugin:
         self.action.triggered.connect(self.run)
         # add toolbar button and menu item
         self.iface.pluginMenu().addAction(self.action)
+        self.initProcessing()
+
+    def initProcessing(self):
+        """Registers the Processing provider, also used by qgis_process"""
+        self.provider = LineAnalysisProvider()
+        QgsApplication.processingRegistry().addProvider(self.provider)
 
     def unload(self):
         # remove the plugin menu item and icon
         self.iface.pluginMenu().removeAction(self.action)
+        QgsApplication.processingRegistry().removeProvider(self.provider)
 
     def run(self):
+        # the analysis and output modules are only loaded once the plugin is
+        # used, to keep the QGIS start up fast
+        from .cache import ResultCache
+        from .lineAnalysis import CheckIntersections
+        from .outputWriter import (
+            CSVStreamWriter,
+            GeoStreamWriter,
+            SummaryStreamWriter,
+            XLSXStreamWriter,
+            is_parquet_available,
+            is_xlsx_available,
+        )
+
         # Check that there is a file open
         if QgsProject.instance().fileName() == "":
             self.iface.messageBar().pushMessage(
@@ -101,11 +123,86 @@ class lineAnalisisPlugin:
             )
             return False
         # Task execution
-        self.main_task = CheckIntersections(layers, prospect_layer, layer_attr_map)
+        folder = Path(QgsProject.instance().fileName()).parent
+        self.output_format = get_setting("output_format", "csv")
+        if self.output_format == "xlsx" and not is_xlsx_available():
+            self.iface.messageBar().pushMessage(
+                title=f"{PLUGIN_NAME} Warning",
+                text="openpyxl is not installed, writing a csv report instead",
+                level=Qgis.Warning,
+                duration=5,
+            )
+            self.output_format = "csv"
+        if self.output_format == "parquet" and not is_parquet_available():
+            self.iface.messageBar().pushMessage(
+                title=f"{PLUGIN_NAME} Warning",
+                text="GDAL has no Parquet driver, writing a GeoPackage instead",
+                level=Qgis.Warning,
+                duration=5,
+            )
+            self.output_format = "gpkg"
+        chunk_size = get_setting("chunk_size", 0)
+        # {"layer name": distance}, instead of pre-buffered layer copies
+        distances = json.loads(get_setting("corridor_distances", "{}"))
+        stream = None
+        # the GeoPackage and Parquet outputs are always written as a stream
+        if self.output_format in ("gpkg", "parquet"):
+            stream = GeoStreamWriter(
+                folder,
+                layers,
+                layer_attr_map,
+                prospect_layer.crs(),
+                extension=self.output_format,
+                distances=distances,
+            )
+        # chunked runs stream their results to keep memory flat
+        elif get_setting("stream_output", False) or chunk_size:
+            if self.output_format == "xlsx":
+                stream = XLSXStreamWriter(folder, layer_attr_map)
+            else:
+                stream = CSVStreamWriter(folder, layer_attr_map)
+        self.summary_output = get_setting("summary_output", False)
+        self.detail_output = get_setting("detail_output", True)
+        keep_geometry = isinstance(stream, GeoStreamWriter) and self.detail_output
+        if stream is not None and (self.summary_output or not self.detail_output):
+            stream = SummaryStreamWriter(folder, stream if self.detail_output else None)
+        cache = None
+        if get_setting("use_cache", True):
+            cache = ResultCache(folder, refresh=get_setting("refresh_cache", False))
+        self.main_task = CheckIntersections(
+            layers,
+            prospect_layer,
+            layer_attr_map,
+            segment_length=get_setting("segment_length", 0.0),
+            parallel=get_setting("parallel", True),
+            stream=stream,
+            verbosity=get_setting("verbosity", LOG_SUMMARY),
+            log_interval=get_setting("log_interval", 5.0),
+            cache=cache,
+            vectorized=get_setting("vectorized", False),
+            profile=get_setting("profile", False),
+            keep_geometry=keep_geometry,
+            distances=distances,
+            layer_major=get_setting("layer_major", False),
+            max_vertices=get_setting("max_vertices", 0),
+            chunk_size=chunk_size,
+            checkpoint_folder=folder,
+            resume=get_setting("resume", True),
+        )
         self.main_task.taskCompleted.connect(self.on_main_task_completed)
         QgsApplication.taskManager().addTask(self.main_task)
 
     def on_main_task_completed(self):
+        from .outputWriter import WriteCSVTask, WriteXLSXTask
+
+        if self.main_task.stream is not None:
+            self.iface.messageBar().pushMessage(
+                title=f"{PLUGIN_NAME} Info",
+                text=f"Output written to {self.main_task.stream.filename}",
+                level=Qgis.Success,
+                duration=0,
+            )
+            return
         self.iface.messageBar().pushMessage(
             title=f"{PLUGIN_NAME} Info",
             text=f"Analysis Complete, Creating and Cleaning Report",
@@ -114,8 +211,16 @@ class lineAnalisisPlugin:
         )
         # Get a available filename
         folder = Path(QgsProject.instance().fileName()).parent
-        self.output_task = WriteCSVTask(
-            folder, self.main_task.results, self.main_task.layer_attr_map
+        output_task_class = WriteCSVTask
+        if self.output_format == "xlsx":
+            output_task_class = WriteXLSXTask
+        self.output_task = output_task_class(
+            folder,
+            self.main_task.results,
+            self.main_task.layer_attr_map,
+            stats=self.main_task.stats,
+            summary=self.summary_output,
+            detail=self.detail_output,
         )
         self.output_task.taskCompleted.connect(self.on_output_task_completed)
         QgsApplication.taskManager().addTask(self.output_task)
@@ -132,6 +237,8 @@ class lineAnalisisPlugin:
         self, layers: tuple[QgsVectorLayer.VectorLayer]
     ) -> QgsVectorLayer.VectorLayer:
         """Returns the selected layer name, from the TreeView or the dialog"""
+        from .pluginUI import LayerSelectionDialog
+
         if len(layers) != 1:
             dlg = LayerSelectionDialog(self.iface.mainWindow())
             dlg.exec()
@@ -144,6 +251,8 @@ class lineAnalisisPlugin:
         self, layers: tuple[QgsVectorLayer.VectorLayer]
     ) -> dict[str, tuple[bool, dict[str, bool]]]:
         """Gets a map of layers:attributes list for the output"""
+        from .pluginUI import LayerSelectionTree
+
         layer_attr_map_file = (
             Path(QgsProject.instance().fileName()).parent / "layer_attr_map.json"
         )
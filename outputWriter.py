@@ -4,36 +4,230 @@ Module for diferent clasess of output formats
 """
 
 import csv
-import sys
+import pickle
+import re
 from datetime import date, datetime
-from time import sleep
 
 from qgis.core import *
-from qgis.PyQt.QtCore import QDate, QDateTime, QVariant
+from qgis.PyQt.QtCore import QVariant
 
-from .tools import PLUGIN_NAME, get_excel_cols, get_feature_attributes, plugin_path
+from .stats import RunStats, get_sidecar
+from .tools import PLUGIN_NAME, get_selected_attributes
+
+try:
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    from openpyxl.styles import Font
+    from openpyxl.utils import get_column_letter
+except ImportError:
+    Workbook = None
+
+RESULT_FIELDNAMES = (
+    "qgis_prospect_line",
+    "qgis_layer",
+    "qgis_feature_id",
+    "intersections (No)",
+    "length (km)",
+    "area (ha)",
+)
+# only in corridor mode, pruned like the attributes when no result has it
+DISTANCE_FIELDNAME = "distance (m)"
+
+SUMMARY_FIELDNAMES = (
+    "qgis_prospect_line",
+    "qgis_layer",
+    "hits",
+    "intersections (No)",
+    "length (km)",
+    "area (ha)",
+)
+
+# columns of the GeoPackage/Parquet tables, before the layer attributes
+GEO_FIELDS = (
+    ("prospect_id", QVariant.LongLong),
+    ("prospect_line", QVariant.String),
+    ("feature_id", QVariant.LongLong),
+    ("intersections", QVariant.Int),
+    ("length_km", QVariant.Double),
+    ("area_ha", QVariant.Double),
+    ("distance_m", QVariant.Double),
+)
+# features added to the GeoPackage/Parquet writer at a time
+GEO_BATCH = 10000
+# cell types openpyxl writes as they are, the rest are written as text
+XLSX_TYPES = (int, float, date, datetime)
+# longest text an Excel cell holds
+XLSX_MAX_TEXT = 32767
+# rows of an Excel sheet after the header, more go to the next sheet
+XLSX_MAX_ROWS = 1048575
+
+# functions
+
+
+def get_output_filename(folder, extension="csv"):
+    """First output_N file name not used yet in folder"""
+    for i in range(1, 1000):
+        filename = folder / f"output_{i}.{extension}"
+        if not filename.exists():
+            break
+    return filename
+
+
+def is_xlsx_available():
+    """openpyxl is optional, without it only csv output can be written"""
+    return Workbook is not None
+
+
+def get_xlsx_value(value):
+    """A value openpyxl accepts: numbers and dates as they are, anything
+    else as text without the control characters Excel refuses"""
+    if value is None or isinstance(value, XLSX_TYPES):
+        return value
+    return ILLEGAL_CHARACTERS_RE.sub("", str(value))[:XLSX_MAX_TEXT]
+
+
+def add_xlsx_sheet(wb, title, fieldnames):
+    """Adds a sheet with the header of fieldnames to a write-only workbook"""
+    ws = wb.create_sheet(title)
+    for i, name in enumerate(fieldnames, 1):
+        ws.column_dimensions[get_column_letter(i)].width = max(len(name) + 2, 10)
+    ws.freeze_panes = "A2"
+    if fieldnames:
+        ws.auto_filter.ref = f"A1:{get_column_letter(len(fieldnames))}1"
+    header = []
+    for name in fieldnames:
+        cell = WriteOnlyCell(ws, value=name)
+        cell.font = Font(bold=True)
+        header.append(cell)
+    ws.append(header)
+    return ws
+
+
+def write_xlsx(filename, fieldnames, rows):
+    """Writes rows, lists in the order of fieldnames, to a write-only
+    workbook, which keeps only the current row in memory
+
+    Rows past the XLSX_MAX_ROWS of a sheet go on to Intersections 2, 3...
+    """
+    wb = Workbook(write_only=True)
+    ws = add_xlsx_sheet(wb, "Intersections", fieldnames)
+    sheet = 1
+    sheet_rows = 0
+    for row in rows:
+        if sheet_rows == XLSX_MAX_ROWS:
+            sheet += 1
+            sheet_rows = 0
+            ws = add_xlsx_sheet(wb, f"Intersections {sheet}", fieldnames)
+        ws.append([get_xlsx_value(value) for value in row])
+        sheet_rows += 1
+    wb.save(filename)
+
+
+def is_parquet_available():
+    """GDAL has the Parquet driver only when it is built with Arrow"""
+    return any(
+        driver.driverName == "Parquet" for driver in QgsVectorFileWriter.ogrDriverList()
+    )
+
+
+def get_table_name(layer_name, used):
+    """Name of the output table of a search layer, unique among used"""
+    base = re.sub(r"\W+", "_", layer_name.split(" — ")[0]).strip("_").lower()
+    name = base or "layer"
+    i = 1
+    while name in used:
+        i += 1
+        name = f"{base}_{i}"
+    used.add(name)
+    return name
+
+
+def get_intersection_type(layer, distance=0):
+    """Geometry type of the intersections of the prospect lines with layer,
+    lines for polygons and points for the rest
+
+    In corridor mode the hits are the features cut by the buffer of the
+    lines, so they keep the geometry type of the layer.
+    """
+    geometry_type = layer.geometryType()
+    if distance > 0:
+        if geometry_type == QgsWkbTypes.PolygonGeometry:
+            return QgsWkbTypes.MultiPolygon
+        if geometry_type == QgsWkbTypes.LineGeometry:
+            return QgsWkbTypes.MultiLineString
+        return QgsWkbTypes.MultiPoint
+    if geometry_type == QgsWkbTypes.PolygonGeometry:
+        return QgsWkbTypes.MultiLineString
+    return QgsWkbTypes.MultiPoint
+
+
+def get_output_geometry(wkb, wkb_type):
+    """Geometry of a WKB intersection as the type of its table, lines that
+    overlap a line layer are kept as their vertices"""
+    geometry = QgsGeometry()
+    geometry.fromWkb(wkb)
+    if geometry.isEmpty():
+        return QgsGeometry()
+    geometry_type = QgsWkbTypes.geometryType(wkb_type)
+    if geometry.type() != geometry_type:
+        geometry = geometry.convertToType(geometry_type, True)
+    elif not geometry.isMultipart():
+        geometry.convertToMultiType()
+    return geometry
+
+
+def read_pickled_rows(temp_file):
+    """Rows pickled one after the other to a temporary file"""
+    while True:
+        try:
+            yield pickle.load(temp_file)
+        except EOFError:
+            return
+
+
+def get_result_row(result):
+    """Row of the report for an IntersectionResult, its attribute values are
+    already converted by the analysis"""
+    row = {
+        "qgis_prospect_line": result.prospect_line,
+        "qgis_layer": result.layer_name.split(" — ")[0],
+        "qgis_feature_id": result.feature_id,
+        "intersections (No)": result.intersections,
+        "length (km)": result.length / 1000,
+        "area (ha)": result.area / 10000,
+    }
+    if result.distance is not None:
+        row[DISTANCE_FIELDNAME] = result.distance
+    return row | result.attribute_map()
 
-# import_path = plugin_path("./venv/lib/python3.13/site-packages")
-# sys.path.insert(0, import_path)
-# from openpyxl import Workbook
-# from openpyxl.styles import (Alignment, Border, Font, PatternFill, Protection,
-#                              Side)
 
 # Classes
 
 
 class WriteCSVTask(QgsTask):
-    """Task that creates and cleans a csv file"""
+    """Task that creates and cleans a csv file, and optionally a summary per
+    prospect line and layer next to it, or only the summary"""
 
-    def __init__(self, folder, results, layers_attributes_map):
+    def __init__(
+        self,
+        folder,
+        results,
+        layers_attributes_map,
+        filename=None,
+        stats=None,
+        summary=False,
+        detail=True,
+    ):
         super().__init__("Creating and Cleaning CSV")
-        for i in range(1, 1000):
-            filename = folder / f"output_{i}.csv"
-            if not filename.exists():
-                break
-        self.filename = filename
+        self.filename = filename or get_output_filename(folder)
+        if not detail:
+            self.filename = filename or get_output_filename(folder, "summary.csv")
         self.results = results
         self.layers_attributes_map = layers_attributes_map
+        self.stats = stats if stats is not None else RunStats()
+        self.summary = summary or not detail
+        self.detail = detail
 
     def run(self):
         QgsMessageLog.logMessage(
@@ -41,17 +235,29 @@ class WriteCSVTask(QgsTask):
             PLUGIN_NAME,
             Qgis.Success,
         )
-        fieldnames, rows = self.get_csv_fieldnames_and_rows()
-        with open(self.filename, "w", newline="") as csvfile:
-            writer = csv.DictWriter(
-                csvfile,
-                fieldnames=fieldnames.keys(),
-                dialect="excel",
-                extrasaction="ignore",
-            )
-            writer.writeheader()
-            for row in rows:
-                writer.writerow(row)
+        if self.summary:
+            self.write_summary()
+        if not self.detail:
+            self.stats.save(self.filename)
+            return True
+        with self.stats.timer("write"):
+            prepared = self.get_csv_fieldnames_and_rows()
+            if prepared is False:
+                return False
+            fieldnames, rows = prepared
+            with open(self.filename, "w", newline="") as csvfile:
+                writer = csv.DictWriter(
+                    csvfile,
+                    fieldnames=fieldnames.keys(),
+                    dialect="excel",
+                    extrasaction="ignore",
+                )
+                writer.writeheader()
+                for row in rows:
+                    writer.writerow(row)
+        self.stats.count("rows_written", len(rows))
+        self.stats.count("bytes_written", self.filename.stat().st_size)
+        self.stats.save(self.filename)
         return True
 
     def finished(self, result):
@@ -61,36 +267,31 @@ class WriteCSVTask(QgsTask):
             Qgis.Success,
         )
 
-    def clean(self, attributes):
-        for key, value in attributes.items():
-            if type(value) in (date, datetime):
-                attributes[key] = value.isoformat()
-            # elif type(value) is float:
-            #     attributes[key] = str(value).replace(".", ",")
-            #     attributes[key] = str(round(value, 2))
-            #     attributes[key] = str(value)
-        return attributes
+    def write_summary(self):
+        """Writes the totals per prospect line and layer, next to the detail
+        file or as the output when there is no detail file"""
+        filename = self.filename
+        if self.detail:
+            filename = get_sidecar(self.filename, ".summary.csv")
+        with self.stats.timer("summary"):
+            summary = ResultSummary()
+            for result in self.results:
+                summary.add(result)
+            self.stats.count("summary_rows", summary.write(filename))
 
     def get_csv_fieldnames_and_rows(self):
-        fieldnames = {
-            "qgis_prospect_line": True,
-            "qgis_layer": True,
-            "qgis_feature_id": True,
-            "intersections (No)": True,
-            "length (km)": True,
-            "area (ha)": True,
-        }
+        fieldnames = dict.fromkeys(RESULT_FIELDNAMES, True)
+        fieldnames[DISTANCE_FIELDNAME] = False
         total = len(self.results)
         layers = []
         for i, result in enumerate(self.results):
             self.setProgress(i * 10 / total)
             if self.isCanceled():
                 return False
-            if result["layer"] not in layers:
-                layer = result["layer"]
-                layers.append(layer)
+            if result.layer_name not in layers:
+                layers.append(result.layer_name)
                 layer_valid, attrs = self.layers_attributes_map.get(
-                    layer.name(), (False, {})
+                    result.layer_name, (False, {})
                 )
                 if not layer_valid:
                     continue
@@ -106,24 +307,13 @@ class WriteCSVTask(QgsTask):
             self.setProgress(10 + i * 90 / total)
             if self.isCanceled():
                 return False
-            line = result["prospect_feature"].attributeMap().get("name")
-            if line is None or (type(line) is QVariant and line.isNull()):
-                line = result["prospect_feature"].id()
-            data = self.clean(
-                {
-                    "qgis_prospect_line": line,
-                    "qgis_layer": result["layer"].name().split(" — ")[0],
-                    "qgis_feature_id": result["feature"].id(),
-                    "intersections (No)": result["intersections"],
-                    "length (km)": result["length"] / 1000,
-                    "area (ha)": result["area"] / 10000,
-                }
-                | get_feature_attributes(result["feature"])
-            )
+            data = get_result_row(result)
             for key, value in data.items():
                 if key in fieldnames:
                     if not fieldnames[key] and value:
                         fieldnames[key] = True
+            if result.distance is not None:
+                fieldnames[DISTANCE_FIELDNAME] = True
             rows.append(data)
         to_delete = []
         for key, has_value in fieldnames.items():
@@ -134,146 +324,413 @@ class WriteCSVTask(QgsTask):
         return fieldnames, rows
 
 
-# class WriteXLSX(QgsTask):
-#     """Task that creates and cleans an Excel file"""
-
-#     font_general = Font(
-#         name="Calibri",
-#         size=11,
-#         bold=False,
-#         italic=False,
-#         vertAlign=None,
-#         underline="none",
-#         strike=False,
-#         color="FF000000",
-#     )
-
-#     font_title = Font(
-#         name="Calibri",
-#         size=11,
-#         bold=True,
-#         italic=False,
-#         vertAlign=None,
-#         underline="none",
-#         strike=False,
-#         color="FF000000",
-#     )
-
-#     alignment_general = Alignment(
-#         horizontal="left",
-#         vertical="center",
-#         text_rotation=0,
-#         wrap_text=True,
-#         shrink_to_fit=True,
-#         indent=0,
-#     )
-
-#     alignment_center = Alignment(
-#         horizontal="center",
-#         vertical="center",
-#         text_rotation=0,
-#         wrap_text=True,
-#         shrink_to_fit=True,
-#         indent=0,
-#     )
-
-#     estilos = {
-#         "general": alignment_general,
-#         "center": alignment_center,
-#     }
-
-#     def __init__(self, filename, results, layers_attributes_map):
-#         super().__init__("Creating and Cleaning an Excel file")
-#         self.filename = filename
-#         self.results = results
-#         self.layers_attributes_map = layers_attributes_map
-
-#     def run(self):
-#         fieldnames = {
-#             "qgis_prospect_line": [10, "center", True],
-#             "qgis_layer": [25, "center", True],
-#             "qgis_feature_id": [10, "center", True],
-#             "intersections (No)": [10, "general", True],
-#             "length (km)": [10, "general", True],
-#             "area (ha)": [10, "general", True],
-#         }
-#         total = len(self.results)
-#         layers = []
-#         for i, result in enumerate(self.results):
-#             self.setProgress(i * 45 / total)
-#             if self.isCanceled():
-#                 return False
-#             if result["layer"] not in layers:
-#                 layer = result["layer"]
-#                 layers.append(layer)
-#                 if layer.name() in self.layers_attributes_map:
-#                     for attr in self.layers_attributes_map[layer.name()]:
-#                         if attr not in fieldnames:
-#                             fieldnames[attr] = [10, "general", False]
-#                 else:
-#                     for attr in list(layer.attributeAliases().keys()):
-#                         if attr not in fieldnames:
-#                             fieldnames[attr] = [10, "general", False]
-#         wb = Workbook()
-#         normal = wb._named_styles["Normal"]
-#         normal.alignment.wrap_text = True
-#         normal.alignment.vertical = "center"
-#         normal.alignment.shrink_to_fit = True
-#         normal.font = self.font_general
-#         ws = wb.active
-#         wb.alignment = self.alignment_general
-#         ws.append(list(fieldnames))
-#         for i, result in enumerate(self.results):
-#             self.setProgress(45 + i * 45 / total)
-#             if self.isCanceled():
-#                 return False
-#             line = result["prospect_feature"].attributeMap().get("name")
-#             if line is None or (type(line) is QVariant and line.isNull()):
-#                 line = result["prospect_feature"].id()
-#             data = {
-#                 "qgis_prospect_line": line,
-#                 "qgis_layer": result["layer"].name().split(" — ")[0],
-#                 "qgis_feature_id": result["feature"].id(),
-#                 "intersections (No)": result["intersections"],
-#                 "length (km)": result["length"],
-#                 "area (ha)": result["area"],
-#             } | get_feature_attributes(result["feature"])
-#             for key, value in data.items():
-#                 if key in fieldnames:
-#                     if value:
-#                         fieldnames[key][0] = max(len(str(value)), fieldnames[key][0])
-#                         fieldnames[key][2] = True
-#             try:
-#                 ws.append([data.get(field) for field in fieldnames])
-#             except ValueError as err:
-#                 print([data.get(field) for field in fieldnames])
-#                 print(err)
-#         # extras
-#         to_delete = []
-#         for i, (col, (size, alin, has_value)) in enumerate(
-#             zip(get_excel_cols(), fieldnames.values())
-#         ):
-#             ws.column_dimensions[col].width = size or 10
-#             ws.column_dimensions[col].alignment = self.estilos[alin]
-#             if not has_value:
-#                 to_delete.append((i, col))
-#         filters = ws.auto_filter
-#         filters.ref = f"A:{col}"
-#         total = len(to_delete)
-#         for i, (n, col) in enumerate(to_delete[::-1]):
-#             self.setProgress(90 + i * 10 / total)
-#             if self.isCanceled():
-#                 return False
-#             # ws.delete_cols(n + 1)
-#             ws.column_dimensions[col].hidden = True
-#         ws.row_dimensions[1].font = self.font_title
-#         # save
-#         wb.save(self.filename)
-#         return True
-
-#     def finished(self, result):
-#         QgsMessageLog.logMessage(
-#             f"Output written to {self.filename}",
-#             PLUGIN_NAME,
-#             Qgis.Success,
-#         )
+class ResultSummary:
+    """Totals of the results per prospect line and search layer: hits,
+    intersections, length and area, added up as the results come"""
+
+    def __init__(self):
+        self.totals = {}
+
+    def add(self, result):
+        key = (result.prospect_id, result.layer_name)
+        totals = self.totals.get(key)
+        if totals is None:
+            totals = self.totals[key] = [result.prospect_line, 0, 0, 0, 0]
+        totals[1] += 1
+        totals[2] += result.intersections
+        totals[3] += result.length
+        totals[4] += result.area
+
+    def write(self, filename) -> int:
+        """Writes the totals as a csv file, returns the rows written"""
+        with open(filename, "w", newline="") as csvfile:
+            writer = csv.writer(csvfile, dialect="excel")
+            writer.writerow(SUMMARY_FIELDNAMES)
+            for (_, layer_name), totals in self.totals.items():
+                line, hits, intersections, length, area = totals
+                writer.writerow(
+                    [
+                        line,
+                        layer_name.split(" — ")[0],
+                        hits,
+                        intersections,
+                        length / 1000,
+                        area / 10000,
+                    ]
+                )
+        return len(self.totals)
+
+
+class SummaryStreamWriter:
+    """Adds up the results as the analysis finds them and writes the summary
+    on close, passing them on to a detail stream writer if there is one
+
+    Only one row of totals per prospect line and layer is kept in memory.
+    """
+
+    def __init__(self, folder, detail=None):
+        self.detail = detail
+        if detail is not None:
+            self.filename = detail.filename
+            self.summary_filename = get_sidecar(detail.filename, ".summary.csv")
+        else:
+            self.filename = get_output_filename(folder, "summary.csv")
+            self.summary_filename = self.filename
+        self.summary = ResultSummary()
+        self.rows = 0
+        self.bytes_written = 0
+
+    def open(self):
+        self.summary = ResultSummary()
+        if self.detail is not None:
+            self.detail.open()
+
+    def write(self, result):
+        self.summary.add(result)
+        if self.detail is not None:
+            self.detail.write(result)
+
+    def close(self, discard=False):
+        """Finishes the detail output and writes the summary, or discards
+        both"""
+        if self.detail is not None:
+            self.detail.close(discard)
+        if discard:
+            return
+        rows = self.summary.write(self.summary_filename)
+        self.bytes_written = self.summary_filename.stat().st_size
+        if self.detail is not None:
+            self.rows = self.detail.rows
+            self.bytes_written += self.detail.bytes_written
+        else:
+            self.rows = rows
+
+
+class CSVStreamWriter:
+    """Writes results to a csv file as the analysis finds them
+
+    The columns come from layers_attributes_map, rows go to a temporary file
+    and close() copies it to the output without the columns that never had
+    a value, so memory stays bounded whatever the number of results.
+    """
+
+    def __init__(self, folder, layers_attributes_map, filename=None):
+        self.filename = filename or get_output_filename(folder)
+        self.temp_filename = self.filename.with_name(self.filename.name + ".part")
+        self.fieldnames = dict.fromkeys(RESULT_FIELDNAMES, True)
+        self.fieldnames[DISTANCE_FIELDNAME] = False
+        for layer_valid, attrs in layers_attributes_map.values():
+            if not layer_valid:
+                continue
+            for attr, valid in attrs.items():
+                if valid and attr not in self.fieldnames:
+                    self.fieldnames[attr] = False
+        self.rows = 0
+        self.bytes_written = 0
+        self._file = None
+        self._writer = None
+
+    def open(self):
+        self._file = open(self.temp_filename, "w", newline="")
+        self._writer = csv.DictWriter(
+            self._file,
+            fieldnames=self.fieldnames.keys(),
+            dialect="excel",
+            extrasaction="ignore",
+        )
+        self._writer.writeheader()
+        self.rows = 0
+
+    def write(self, result):
+        data = get_result_row(result)
+        for key, value in data.items():
+            if value and not self.fieldnames.get(key, True):
+                self.fieldnames[key] = True
+        if result.distance is not None:
+            self.fieldnames[DISTANCE_FIELDNAME] = True
+        self._writer.writerow(data)
+        self.rows += 1
+
+    def close(self, discard=False):
+        """Finishes the output, removing the empty columns, or deletes it"""
+        self._file.close()
+        self._file = self._writer = None
+        if discard:
+            self.temp_filename.unlink(missing_ok=True)
+            return
+        keep = [i for i, has_value in enumerate(self.fieldnames.values()) if has_value]
+        with open(self.temp_filename, newline="") as temp_file, open(
+            self.filename, "w", newline=""
+        ) as csvfile:
+            writer = csv.writer(csvfile, dialect="excel")
+            for row in csv.reader(temp_file, dialect="excel"):
+                writer.writerow([row[i] for i in keep])
+        self.temp_filename.unlink()
+        self.bytes_written = self.filename.stat().st_size
+
+
+class WriteXLSXTask(WriteCSVTask):
+    """Task that creates and cleans an Excel file, with the same columns as
+    the csv report"""
+
+    def __init__(
+        self,
+        folder,
+        results,
+        layers_attributes_map,
+        filename=None,
+        stats=None,
+        summary=False,
+        detail=True,
+    ):
+        # without the detail report only the csv summary is written
+        if detail:
+            filename = filename or get_output_filename(folder, "xlsx")
+        super().__init__(
+            folder,
+            results,
+            layers_attributes_map,
+            filename,
+            stats,
+            summary,
+            detail,
+        )
+        self.setDescription("Creating and Cleaning an Excel file")
+
+    def run(self):
+        QgsMessageLog.logMessage(
+            f"Started task {self.description()}",
+            PLUGIN_NAME,
+            Qgis.Success,
+        )
+        if self.summary:
+            self.write_summary()
+        if not self.detail:
+            self.stats.save(self.filename)
+            return True
+        with self.stats.timer("write"):
+            prepared = self.get_csv_fieldnames_and_rows()
+            if prepared is False:
+                return False
+            fieldnames, rows = prepared
+            write_xlsx(
+                self.filename,
+                list(fieldnames),
+                ([row.get(name) for name in fieldnames] for row in rows),
+            )
+        self.stats.count("rows_written", len(rows))
+        self.stats.count("bytes_written", self.filename.stat().st_size)
+        self.stats.save(self.filename)
+        return True
+
+
+class XLSXStreamWriter(CSVStreamWriter):
+    """Writes results to an Excel file as the analysis finds them
+
+    Rows are pickled to a temporary file while the analysis runs, keeping
+    their types, and close() streams them to a write-only workbook without
+    the columns that never had a value.
+    """
+
+    def __init__(self, folder, layers_attributes_map, filename=None):
+        super().__init__(
+            folder,
+            layers_attributes_map,
+            filename or get_output_filename(folder, "xlsx"),
+        )
+
+    def open(self):
+        self._file = open(self.temp_filename, "wb")
+        self.rows = 0
+
+    def write(self, result):
+        data = get_result_row(result)
+        for key, value in data.items():
+            if value and not self.fieldnames.get(key, True):
+                self.fieldnames[key] = True
+        if result.distance is not None:
+            self.fieldnames[DISTANCE_FIELDNAME] = True
+        pickle.dump(
+            [data.get(key) for key in self.fieldnames],
+            self._file,
+            pickle.HIGHEST_PROTOCOL,
+        )
+        self.rows += 1
+
+    def close(self, discard=False):
+        """Finishes the output, removing the empty columns, or deletes it"""
+        self._file.close()
+        self._file = None
+        if discard:
+            self.temp_filename.unlink(missing_ok=True)
+            return
+        keep = [i for i, has_value in enumerate(self.fieldnames.values()) if has_value]
+        fieldnames = list(self.fieldnames)
+        with open(self.temp_filename, "rb") as temp_file:
+            write_xlsx(
+                self.filename,
+                [fieldnames[i] for i in keep],
+                ([row[i] for i in keep] for row in read_pickled_rows(temp_file)),
+            )
+        self.temp_filename.unlink()
+        self.bytes_written = self.filename.stat().st_size
+
+
+class GeoStreamWriter:
+    """Writes results with the geometry of the intersections, to a table per
+    search layer of a GeoPackage, or a GeoParquet file per search layer in an
+    output_N.parquet folder
+
+    The columns are typed: the measures, then the selected attributes with
+    the field types of their layer. distances are the corridor distances by
+    layer name, as given to CheckIntersections. Rows are pickled to a temporary file per
+    layer while the analysis runs, and close() writes every table in turn in
+    batches of GEO_BATCH features, one transaction per table, with a spatial
+    index.
+    """
+
+    DRIVERS = {".gpkg": "GPKG", ".parquet": "Parquet"}
+
+    def __init__(
+        self,
+        folder,
+        layers,
+        layers_attributes_map,
+        crs,
+        filename=None,
+        extension="gpkg",
+        distances=None,
+        transform_context=None,
+    ):
+        self.filename = filename or get_output_filename(folder, extension)
+        self.driver = self.DRIVERS[self.filename.suffix.lower()]
+        self.crs = crs
+        self.transform_context = transform_context
+        if transform_context is None:
+            self.transform_context = QgsProject.instance().transformContext()
+        self.tables = {}
+        used = set()
+        for layer in layers:
+            if not layers_attributes_map.get(layer.name(), (False, None))[0]:
+                continue
+            fields = QgsFields()
+            for name, field_type in GEO_FIELDS:
+                fields.append(QgsField(name, field_type))
+            layer_fields = layer.fields()
+            positions = []
+            for i, name in enumerate(
+                get_selected_attributes(layers_attributes_map, layer.name())
+            ):
+                index = layer_fields.lookupField(name)
+                if index < 0:
+                    continue
+                field = QgsField(layer_fields.at(index))
+                # a fid column would be taken as the feature id of the table,
+                # which repeats when a feature hits several lines
+                if (
+                    field.name().lower() == "fid"
+                    or fields.lookupField(field.name()) >= 0
+                ):
+                    field.setName(f"attr_{field.name()}")
+                fields.append(field)
+                positions.append(i)
+            self.tables[layer.name()] = (
+                get_table_name(layer.name(), used),
+                fields,
+                positions,
+                get_intersection_type(layer, (distances or {}).get(layer.name(), 0)),
+            )
+        self.rows = 0
+        self.bytes_written = 0
+        self._files = {}
+
+    def get_temp_filename(self, table):
+        return self.filename.with_name(f"{self.filename.name}.{table}.part")
+
+    def get_table_filename(self, table):
+        if self.driver == "Parquet":
+            return self.filename / f"{table}.parquet"
+        return self.filename
+
+    def open(self):
+        self._files = {
+            layer_name: open(self.get_temp_filename(table), "wb")
+            for layer_name, (table, *_) in self.tables.items()
+        }
+        self.rows = 0
+
+    def write(self, result):
+        table, fields, positions, wkb_type = self.tables[result.layer_name]
+        values = [
+            result.prospect_id,
+            result.prospect_line,
+            result.feature_id,
+            result.intersections,
+            result.length / 1000,
+            result.area / 10000,
+            result.distance,
+        ] + [result.attribute_values[i] for i in positions]
+        pickle.dump(
+            (values, result.geometry),
+            self._files[result.layer_name],
+            pickle.HIGHEST_PROTOCOL,
+        )
+        self.rows += 1
+
+    def close(self, discard=False):
+        """Writes the tables from the temporary files, or deletes them"""
+        for _file in self._files.values():
+            _file.close()
+        self._files = {}
+        if not discard:
+            if self.driver == "Parquet":
+                self.filename.mkdir(exist_ok=True)
+            first = True
+            for table, fields, _, wkb_type in self.tables.values():
+                with open(self.get_temp_filename(table), "rb") as temp_file:
+                    rows = read_pickled_rows(temp_file)
+                    self.write_table(table, fields, wkb_type, rows, first)
+                first = False
+            if self.driver == "Parquet":
+                self.bytes_written = sum(
+                    path.stat().st_size for path in self.filename.glob("*.parquet")
+                )
+            elif self.filename.exists():
+                self.bytes_written = self.filename.stat().st_size
+        for table, *_ in self.tables.values():
+            self.get_temp_filename(table).unlink(missing_ok=True)
+
+    def write_table(self, table, fields, wkb_type, rows, first):
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = self.driver
+        options.layerName = table
+        options.fileEncoding = "UTF-8"
+        if self.driver == "GPKG" and not first:
+            options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteLayer
+        writer = QgsVectorFileWriter.create(
+            str(self.get_table_filename(table)),
+            fields,
+            wkb_type,
+            self.crs,
+            self.transform_context,
+            options,
+        )
+        if writer.hasError() != QgsVectorFileWriter.NoError:
+            raise OSError(f"Can not write {table}: {writer.errorMessage()}")
+        batch = []
+        for values, wkb in rows:
+            feat = QgsFeature(fields)
+            feat.setAttributes(values)
+            if wkb is not None:
+                feat.setGeometry(get_output_geometry(wkb, wkb_type))
+            batch.append(feat)
+            if len(batch) >= GEO_BATCH:
+                self.add_features(writer, table, batch)
+                batch = []
+        self.add_features(writer, table, batch)
+        # the features are committed when the writer is deleted
+        del writer
+
+    def add_features(self, writer, table, batch):
+        if batch and not writer.addFeatures(batch):
+            raise OSError(f"Can not write {table}: {writer.errorMessage()}")
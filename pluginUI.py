@@ -1,6 +1,5 @@
 """Plugin Selection Dialog."""
 
-import qgis.utils
 from qgis.core import QgsProject, QgsSymbolLayerUtils, QgsVectorLayer
 from qgis.PyQt import uic
 from qgis.PyQt.QtCore import QSize, Qt
@@ -9,16 +8,14 @@ from qgis.PyQt.QtWidgets import QDialog, QTreeWidgetItem, QWidget
 
 from .tools import filter_search_layers, plugin_path
 
-LAYER_PROSPECT_CLASS = uic.loadUiType(str(plugin_path("LayerProspect.ui")))[0]
-LAYER_ATTR_TREE_CLASS = uic.loadUiType(str(plugin_path("LayerAttrMap.ui")))[0]
 
-
-class LayerSelectionDialog(QDialog, LAYER_PROSPECT_CLASS):
+class LayerSelectionDialog(QDialog):
     """Plugin Layer Selection Window."""
 
     def __init__(self, parent: QWidget):
         super().__init__(parent)
-        self.setupUi(self)
+        # the .ui is loaded when the dialog is opened, not at QGIS start up
+        uic.loadUi(str(plugin_path("LayerProspect.ui")), self)
         self.setWindowTitle("Select a Layer")
         self.label.setText("Select the layer you want to check collisions on:")
 
@@ -35,8 +32,12 @@ class LayerSelectionDialog(QDialog, LAYER_PROSPECT_CLASS):
             self.comboPlugin.addItem(icon, layer.name())
 
 
-class LayerSelectionTree(QDialog, LAYER_ATTR_TREE_CLASS):
-    """Plugin Layer and Attribute Selection Dialog."""
+class LayerSelectionTree(QDialog):
+    """Plugin Layer and Attribute Selection Dialog.
+
+    Only the layer items are created when it opens, the attributes of a
+    layer are added the first time its item is expanded.
+    """
 
     def __init__(
         self,
@@ -45,25 +46,40 @@ class LayerSelectionTree(QDialog, LAYER_ATTR_TREE_CLASS):
         layer_attr_map: dict[str, tuple[bool, dict[str, bool]]],
     ):
         super().__init__(parent)
-        self.setupUi(self)
+        uic.loadUi(str(plugin_path("LayerAttrMap.ui")), self)
         self.layers = layers
+        self.layer_attr_map = layer_attr_map
 
         for layer in self.layers:
             parent = QTreeWidgetItem(self.treeWidget)
             parent.setText(0, layer.name())
             parent.setFlags(parent.flags() | Qt.ItemIsUserCheckable)
+            parent.setChildIndicatorPolicy(QTreeWidgetItem.ShowIndicator)
             if layer_attr_map.get(layer.name(), (False, None))[0]:
                 parent.setCheckState(0, Qt.Checked)
             else:
                 parent.setCheckState(0, Qt.Unchecked)
-            for attr in layer.attributeAliases().keys():
-                child = QTreeWidgetItem(parent)
-                child.setFlags(child.flags() | Qt.ItemIsUserCheckable)
-                child.setText(0, attr)
-                if layer_attr_map.get(layer.name(), (False, {}))[1].get(attr, False):
-                    child.setCheckState(0, Qt.Checked)
-                else:
-                    child.setCheckState(0, Qt.Unchecked)
+        self.populated = set()
+        self.treeWidget.itemExpanded.connect(self.populate)
+
+    def get_attributes(self, layer) -> dict[str, bool]:
+        """The attributes of layer and if they are selected"""
+        selected = self.layer_attr_map.get(layer.name(), (False, {}))[1]
+        return {attr: selected.get(attr, False) for attr in layer.attributeAliases()}
+
+    def populate(self, parent):
+        """Adds the attribute items of a layer item, when first expanded"""
+        index = self.treeWidget.indexOfTopLevelItem(parent)
+        if index < 0 or index in self.populated:
+            return
+        self.populated.add(index)
+        for attr, valid in self.get_attributes(self.layers[index]).items():
+            child = QTreeWidgetItem(parent)
+            child.setFlags(child.flags() | Qt.ItemIsUserCheckable)
+            child.setText(0, attr)
+            child.setCheckState(0, Qt.Checked if valid else Qt.Unchecked)
+        if not parent.childCount():
+            parent.setChildIndicatorPolicy(QTreeWidgetItem.DontShowIndicator)
 
     def get_items(self) -> dict[str, tuple[bool, dict[str, bool]]]:
         layer_attr_map = dict()
@@ -71,10 +87,13 @@ class LayerSelectionTree(QDialog, LAYER_ATTR_TREE_CLASS):
         signal_count = root.childCount()
         for i in range(signal_count):
             signal = root.child(i)
-            attr = dict()
-            num_children = signal.childCount()
-            for n in range(num_children):
-                child = signal.child(n)
-                attr[child.text(0)] = child.checkState(0) == Qt.Checked
+            if i in self.populated:
+                attr = dict()
+                num_children = signal.childCount()
+                for n in range(num_children):
+                    child = signal.child(n)
+                    attr[child.text(0)] = child.checkState(0) == Qt.Checked
+            else:
+                attr = self.get_attributes(self.layers[i])
             layer_attr_map[signal.text(0)] = (signal.checkState(0) == Qt.Checked, attr)
         return layer_attr_map
@@ -0,0 +1,217 @@
+"""processingProvider.py
+
+Processing provider and algorithms, to run the analysis without the GUI,
+from the Processing toolbox, batch processes or qgis_process
+"""
+
+import json
+from pathlib import Path
+
+from qgis.core import (
+    QgsMapLayer,
+    QgsProcessing,
+    QgsProcessingAlgorithm,
+    QgsProcessingParameterBoolean,
+    QgsProcessingException,
+    QgsProcessingParameterFile,
+    QgsProcessingParameterFileDestination,
+    QgsProcessingParameterMultipleLayers,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterVectorLayer,
+    QgsProcessingProvider,
+)
+from qgis.PyQt.QtGui import QIcon
+
+from .tools import get_default_layer_attr_map, plugin_path
+
+# Classes
+
+
+class LineAnalysisProvider(QgsProcessingProvider):
+    """Processing provider of the Line Analysis algorithms"""
+
+    def id(self):
+        return "lineanalysis"
+
+    def name(self):
+        return "Line Analysis"
+
+    def icon(self):
+        return QIcon(str(plugin_path("icon.png")))
+
+    def loadAlgorithms(self):
+        self.addAlgorithm(CheckIntersectionsAlgorithm())
+
+
+class CheckIntersectionsAlgorithm(QgsProcessingAlgorithm):
+    """Runs CheckIntersections and writes the csv or xlsx report"""
+
+    PROSPECT_LAYER = "PROSPECT_LAYER"
+    LAYERS = "LAYERS"
+    LAYER_ATTR_MAP = "LAYER_ATTR_MAP"
+    SEGMENT_LENGTH = "SEGMENT_LENGTH"
+    CORRIDOR_DISTANCE = "CORRIDOR_DISTANCE"
+    SUMMARY = "SUMMARY"
+    OUTPUT = "OUTPUT"
+
+    def name(self):
+        return "checkintersections"
+
+    def displayName(self):
+        return "Check intersections"
+
+    def shortHelpString(self):
+        return (
+            "Checks the search layers for features that intersect the lines of "
+            "the prospect layer, and writes the intersections, lengths and areas "
+            "to a csv or xlsx file, or with the intersection geometries to a "
+            "GeoPackage table or GeoParquet file per search layer. The "
+            "layer/attributes map is a layer_attr_map.json "
+            "file as saved by the plugin dialog, without it every search layer "
+            "and attribute is used. With a corridor distance, features up to "
+            "that distance of the lines are also reported, with their distance."
+        )
+
+    def createInstance(self):
+        return CheckIntersectionsAlgorithm()
+
+    def flags(self):
+        # the analysis reads the project layers and makes their feature
+        # sources, which has to happen on the main thread
+        return super().flags() | QgsProcessingAlgorithm.FlagNoThreading
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterVectorLayer(
+                self.PROSPECT_LAYER, "Prospect layer", [QgsProcessing.TypeVectorLine]
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterMultipleLayers(
+                self.LAYERS, "Search layers", QgsProcessing.TypeVectorAnyGeometry
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.LAYER_ATTR_MAP,
+                "Layer/attributes map",
+                extension="json",
+                optional=True,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.SEGMENT_LENGTH,
+                "Segment length for candidate filtering (0 to disable)",
+                QgsProcessingParameterNumber.Double,
+                0,
+                minValue=0,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.CORRIDOR_DISTANCE,
+                "Corridor distance around the lines (0 for intersections only)",
+                QgsProcessingParameterNumber.Double,
+                0,
+                minValue=0,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.SUMMARY,
+                "Also write the totals per line and layer to a .summary.csv file",
+                False,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                self.OUTPUT,
+                "Output",
+                "CSV files (*.csv);;Excel files (*.xlsx);;"
+                "GeoPackage (*.gpkg);;GeoParquet folder (*.parquet)",
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        # loaded on the first run, the provider is registered at start up
+        from .lineAnalysis import CheckIntersections
+        from .outputWriter import (
+            CSVStreamWriter,
+            GeoStreamWriter,
+            SummaryStreamWriter,
+            XLSXStreamWriter,
+            is_parquet_available,
+            is_xlsx_available,
+        )
+
+        prospect_layer = self.parameterAsVectorLayer(
+            parameters, self.PROSPECT_LAYER, context
+        )
+        layers = tuple(
+            layer
+            for layer in self.parameterAsLayerList(parameters, self.LAYERS, context)
+            if layer.type() == QgsMapLayer.VectorLayer and layer is not prospect_layer
+        )
+        layer_attr_map_file = self.parameterAsFile(
+            parameters, self.LAYER_ATTR_MAP, context
+        )
+        if layer_attr_map_file:
+            with open(layer_attr_map_file) as _file:
+                layer_attr_map = json.load(_file)
+        else:
+            layer_attr_map = get_default_layer_attr_map(layers)
+        distances = dict.fromkeys(
+            (layer.name() for layer in layers),
+            self.parameterAsDouble(parameters, self.CORRIDOR_DISTANCE, context),
+        )
+        output = Path(self.parameterAsFileOutput(parameters, self.OUTPUT, context))
+        suffix = output.suffix.lower()
+        if suffix == ".parquet" and not is_parquet_available():
+            raise QgsProcessingException("GDAL has no Parquet driver")
+        if suffix in (".gpkg", ".parquet"):
+            stream = GeoStreamWriter(
+                output.parent,
+                layers,
+                layer_attr_map,
+                prospect_layer.crs(),
+                filename=output,
+                distances=distances,
+                transform_context=context.transformContext(),
+            )
+        elif suffix == ".xlsx":
+            if not is_xlsx_available():
+                raise QgsProcessingException("openpyxl is needed for xlsx output")
+            stream = XLSXStreamWriter(output.parent, layer_attr_map, filename=output)
+        else:
+            stream = CSVStreamWriter(output.parent, layer_attr_map, filename=output)
+        keep_geometry = isinstance(stream, GeoStreamWriter)
+        if self.parameterAsBool(parameters, self.SUMMARY, context):
+            stream = SummaryStreamWriter(output.parent, stream)
+        task = CheckIntersections(
+            layers,
+            prospect_layer,
+            layer_attr_map,
+            segment_length=self.parameterAsDouble(
+                parameters, self.SEGMENT_LENGTH, context
+            ),
+            stream=stream,
+            keep_geometry=keep_geometry,
+            distances=distances,
+            transform_context=context.transformContext(),
+        )
+
+        def on_progress(progress):
+            # the task runs in this thread, so the feedback is polled here
+            feedback.setProgress(progress)
+            if feedback.isCanceled():
+                task.cancel()
+
+        task.progressChanged.connect(on_progress)
+        if not task.run():
+            raise QgsProcessingException("Analysis canceled")
+        feedback.pushInfo(
+            f"{task.current_features_done} features checked, "
+            f"{task.stream.rows} intersections written to {output}"
+        )
+        return {self.OUTPUT: str(output)}
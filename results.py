@@ -0,0 +1,103 @@
+"""results.py
+
+Compact records of the intersections found by the analysis
+"""
+
+# Classes
+
+
+class IntersectionResult:
+    """An intersection between a prospect line and a feature of a search layer
+
+    Only keeps ids, names and the selected attribute values instead of the
+    features and layers, attribute_names is shared by every result of the
+    same layer. geometry is the WKB of the intersection, in the CRS of the
+    prospect layer, only kept when the output needs it. distance is the
+    distance to the line of the features found in corridor mode.
+    """
+
+    __slots__ = (
+        "prospect_id",
+        "prospect_line",
+        "layer_name",
+        "feature_id",
+        "intersections",
+        "length",
+        "area",
+        "attribute_names",
+        "attribute_values",
+        "geometry",
+        "distance",
+    )
+
+    def __init__(
+        self,
+        prospect_id: int,
+        prospect_line,
+        layer_name: str,
+        feature_id: int,
+        intersections: int,
+        length: float,
+        area: float,
+        attribute_names: tuple[str] = (),
+        attribute_values: tuple = (),
+        geometry: bytes = None,
+        distance: float = None,
+    ):
+        self.prospect_id = prospect_id
+        self.prospect_line = prospect_line
+        self.layer_name = layer_name
+        self.feature_id = feature_id
+        self.intersections = intersections
+        self.length = length
+        self.area = area
+        self.attribute_names = attribute_names
+        self.attribute_values = attribute_values
+        self.geometry = geometry
+        self.distance = distance
+
+    def __repr__(self):
+        return (
+            f"IntersectionResult({self.prospect_line!r}, {self.layer_name!r}, "
+            f"{self.feature_id}, {self.intersections}, {self.length}, {self.area})"
+        )
+
+    def as_record(self) -> list:
+        """The fields as JSON values, the geometry as hex WKB"""
+        return [
+            self.prospect_id,
+            self.prospect_line,
+            self.layer_name,
+            self.feature_id,
+            self.intersections,
+            self.length,
+            self.area,
+            list(self.attribute_names),
+            list(self.attribute_values),
+            None if self.geometry is None else self.geometry.hex(),
+            self.distance,
+        ]
+
+    @classmethod
+    def from_record(cls, record, names=None):
+        """Result from as_record, names shares the attribute names tuples
+        by layer between the results read"""
+        *fields, attribute_names, attribute_values, geometry, distance = record
+        attribute_names = tuple(attribute_names)
+        if names is not None:
+            attribute_names = names.setdefault(attribute_names, attribute_names)
+        return cls(
+            *fields,
+            attribute_names,
+            tuple(attribute_values),
+            None if geometry is None else bytes.fromhex(geometry),
+            distance,
+        )
+
+    def attribute_map(self) -> dict:
+        """The attributes with a value, by name"""
+        return {
+            name: value
+            for name, value in zip(self.attribute_names, self.attribute_values)
+            if value is not None
+        }
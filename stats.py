@@ -0,0 +1,106 @@
+"""stats.py
+
+Timers and counters of the analysis and output tasks, to tell where the
+time of a slow run goes
+"""
+
+import json
+import pstats
+from contextlib import contextmanager
+from time import perf_counter
+
+# functions
+
+
+def get_sidecar(filename, suffix):
+    """File next to an output file, output_1.csv -> output_1{suffix}"""
+    return filename.with_name(filename.stem + suffix)
+
+
+# Classes
+
+
+class RunStats:
+    """Timers and counters of a run, in total and per layer
+
+    Counters are candidates fetched, exact tests, hits, bytes written...,
+    timers are seconds by stage: fetch, intersects, intersection,
+    attributes, convert, write... Anything counted for a layer also adds to the
+    totals.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.timers = {}
+        self.layers = {}
+        self.profiler = None
+
+    def _targets(self, kind, layer):
+        yield getattr(self, kind)
+        if layer is not None:
+            yield self.layers.setdefault(layer, {"counters": {}, "timers": {}})[kind]
+
+    def count(self, name, value=1, layer=None):
+        for counters in self._targets("counters", layer):
+            counters[name] = counters.get(name, 0) + value
+
+    def add_time(self, name, seconds, layer=None):
+        for timers in self._targets("timers", layer):
+            timers[name] = timers.get(name, 0) + seconds
+
+    def get(self, name, layer=None):
+        """Value of a counter"""
+        if layer is None:
+            return self.counters.get(name, 0)
+        return self.layers.get(layer, {}).get("counters", {}).get(name, 0)
+
+    @contextmanager
+    def timer(self, name, layer=None):
+        """Adds the time spent in the with block to a timer"""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, perf_counter() - start, layer)
+
+    def timed(self, iterable, name, layer=None):
+        """Yields from iterable, adding the time spent getting each item to a
+        timer, the time spent by the caller with the item is not counted"""
+        iterator = iter(iterable)
+        seconds = 0
+        try:
+            while True:
+                start = perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += perf_counter() - start
+                yield item
+        finally:
+            self.add_time(name, seconds, layer)
+
+    def merge(self, other):
+        """Adds the timers and counters of other, from a subtask or writer"""
+        for name, value in other.counters.items():
+            self.count(name, value)
+        for name, seconds in other.timers.items():
+            self.add_time(name, seconds)
+        for layer, values in other.layers.items():
+            own = self.layers.setdefault(layer, {"counters": {}, "timers": {}})
+            for name, value in values["counters"].items():
+                own["counters"][name] = own["counters"].get(name, 0) + value
+            for name, seconds in values["timers"].items():
+                own["timers"][name] = own["timers"].get(name, 0) + seconds
+
+    def as_dict(self):
+        return {"counters": self.counters, "timers": self.timers, "layers": self.layers}
+
+    def save(self, filename):
+        """Writes the stats as a json next to the output filename, and the
+        profile if the run was profiled"""
+        with get_sidecar(filename, ".stats.json").open("w") as _file:
+            json.dump(self.as_dict(), _file, indent=2)
+        if self.profiler is not None:
+            pstats.Stats(self.profiler).dump_stats(get_sidecar(filename, ".prof"))
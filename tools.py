@@ -1,15 +1,30 @@
 """helper functions"""
 
+import math
 import string
+from datetime import date, datetime
 from pathlib import Path
 
-from qgis.core import QgsProject, QgsVectorLayer
+from qgis.core import (
+    QgsCsException,
+    QgsFeatureRequest,
+    QgsGeometry,
+    QgsProject,
+    QgsSettings,
+    QgsVectorLayer,
+    QgsWkbTypes,
+)
 from qgis.PyQt.QtCore import QDate, QDateTime, QVariant
 
 # Constans
 
 PLUGIN_NAME = "Line Analysis"
 
+# log verbosity of the analysis
+LOG_QUIET = 0
+LOG_SUMMARY = 1
+LOG_VERBOSE = 2
+
 # functions
 
 
@@ -42,6 +57,105 @@ def filter_features(features):
             yield feature
 
 
+def get_geometry_engine(geometry):
+    """Returns a prepared geometry engine for fast repeated predicates"""
+    engine = QgsGeometry.createGeometryEngine(geometry.constGet())
+    engine.prepareGeometry()
+    return engine
+
+
+def subdivide_geometry(geometry, max_vertices):
+    """WKB of the pieces of geometry with at most max_vertices each"""
+    return [
+        bytes(part.asWkb())
+        for part in geometry.subdivide(max(max_vertices, 8)).asGeometryCollection()
+    ]
+
+
+def join_pieces(pieces):
+    """One geometry from the intersections with the pieces of a subdivided
+    feature, lines cut at the borders of the pieces are merged back"""
+    pieces = [piece for piece in pieces if not piece.isEmpty()]
+    if not pieces:
+        return QgsGeometry()
+    joined = QgsGeometry.unaryUnion(pieces)
+    if joined.type() == QgsWkbTypes.LineGeometry:
+        joined = joined.mergeLines()
+    return joined
+
+
+def estimate_features(bbox, extent, count):
+    """Estimates the features of a layer inside bbox, assuming even density"""
+    if extent is None:
+        return count
+    if not bbox.intersects(extent):
+        return 0
+    if extent.area() <= 0:
+        return count
+    return math.ceil(count * bbox.intersect(extent).area() / extent.area())
+
+
+def get_id_request(bbox):
+    """Request for only the ids of the features inside bbox"""
+    return (
+        QgsFeatureRequest(bbox).setFlags(QgsFeatureRequest.NoGeometry).setNoAttributes()
+    )
+
+
+def get_segment_envelopes(geometry, segment_length):
+    """Bounding boxes of consecutive pieces of a line, each at most
+    segment_length long, returns an empty list for other geometries"""
+    if geometry.type() != QgsWkbTypes.LineGeometry:
+        return []
+    envelopes = []
+    for part in geometry.asGeometryCollection():
+        vertices = list(part.densifyByDistance(segment_length).vertices())
+        start = 0
+        length = 0
+        for i in range(1, len(vertices)):
+            length += vertices[i].distance(vertices[i - 1])
+            if length >= segment_length or i == len(vertices) - 1:
+                envelopes.append(
+                    QgsGeometry.fromPolyline(vertices[start : i + 1]).boundingBox()
+                )
+                start = i
+                length = 0
+    return envelopes
+
+
+def get_selected_attributes(layer_attr_map, layer_name):
+    """Names of the attributes of a layer selected for the output"""
+    return [
+        attr
+        for attr, valid in layer_attr_map.get(layer_name, (False, {}))[1].items()
+        if valid
+    ]
+
+
+def get_default_layer_attr_map(layers):
+    """A layer/attributes map with every layer and attribute selected"""
+    return {
+        layer.name(): (True, {attr: True for attr in layer.attributeAliases()})
+        for layer in layers
+    }
+
+
+def get_setting(name, default):
+    """Reads a plugin option from the QGIS settings"""
+    return QgsSettings().value(f"{PLUGIN_NAME}/{name}", default, type=type(default))
+
+
+def transform_extent(extent, transform):
+    """Extent in the destination CRS of transform, None if it can not be
+    transformed"""
+    if transform is None:
+        return extent
+    try:
+        return transform.transformBoundingBox(extent)
+    except QgsCsException:
+        return None
+
+
 def get_prospect_layer(layers, prospect_layer_name):
     for layer in layers:
         if layer.name() == prospect_layer_name:
@@ -52,22 +166,83 @@ def get_prospect_layer(layers, prospect_layer_name):
     raise ValueError("No prospect layer found")
 
 
-def get_feature_attributes(feature):
-    attr_map = feature.attributeMap()
-    for key, value in attr_map.copy().items():
-        if value is None:
-            del attr_map[key]
-        if str(value).strip() in ("NULL", ""):
-            del attr_map[key]
-        elif type(value) is QVariant and value.isNull():
-            del attr_map[key]
-        elif type(value) is QDate:
-            attr_map[key] = value.toPyDate()
-            # attr_map[key] = value.toString("dd/MM/yyyy")
-        elif type(value) is QDateTime:
-            # attr_map[key] = value.toString("dd/MM/yyyy HH:mm:ss")
-            attr_map[key] = value.toPyDateTime()
-    return attr_map
+def get_feature_name(feature):
+    """The name attribute of a feature, or its id if it has no name"""
+    name = feature.attributeMap().get("name")
+    if name is None or (type(name) is QVariant and name.isNull()):
+        return feature.id()
+    return name
+
+
+def convert_value(value):
+    """A raw attribute value ready for the output, None if it is empty"""
+    if value is None:
+        return None
+    value_type = type(value)
+    if value_type is QVariant:
+        return None if value.isNull() else value.value()
+    if value_type is QDate:
+        return value.toPyDate().isoformat() if value.isValid() else None
+    if value_type is QDateTime:
+        return value.toPyDateTime().isoformat() if value.isValid() else None
+    if value_type in (date, datetime):
+        return value.isoformat()
+    if str(value).strip() in ("NULL", ""):
+        return None
+    return value
+
+
+def convert_text(value):
+    if type(value) is str:
+        return value if value.strip() not in ("NULL", "") else None
+    return convert_value(value)
+
+
+def convert_number(value):
+    if type(value) in (int, float) or value is None:
+        return value
+    return convert_value(value)
+
+
+FIELD_CONVERTERS = {
+    QVariant.String: convert_text,
+    QVariant.Int: convert_number,
+    QVariant.UInt: convert_number,
+    QVariant.LongLong: convert_number,
+    QVariant.ULongLong: convert_number,
+    QVariant.Double: convert_number,
+}
+
+
+def get_attribute_converter(fields, names):
+    """Function that turns a feature into the tuple of output ready values of
+    the attributes names, in that order
+
+    Built once per layer from its fields: the attributes are read by
+    position, and each one goes through the conversion of its field type
+    only, instead of checking every value of the attribute map.
+    """
+    plan = []
+    for name in names:
+        index = fields.lookupField(name)
+        if index < 0:
+            plan.append((None, None))
+        else:
+            field_type = fields.at(index).type()
+            plan.append((index, FIELD_CONVERTERS.get(field_type, convert_value)))
+    size = max((index + 1 for index, _ in plan if index is not None), default=0)
+    empty = (None,) * len(plan)
+
+    def convert(feature):
+        values = feature.attributes()
+        if len(values) < size:
+            return empty
+        return tuple(
+            None if index is None else converter(values[index])
+            for index, converter in plan
+        )
+
+    return convert
 
 
 def get_excel_cols():
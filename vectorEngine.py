@@ -0,0 +1,83 @@
+"""vectorEngine.py
+
+Alternative intersection engine that works on whole arrays of geometries
+with Shapely 2 and NumPy, instead of one GEOS call per feature through the
+QGIS bindings. Both are optional, is_available tells if they are installed.
+"""
+
+try:
+    import numpy as np
+    import shapely
+except ImportError:
+    np = None
+    shapely = None
+
+# shapely geometry type ids
+POINT_TYPES = (0, 4)
+LINE_TYPES = (1, 2, 5)
+POLYGON_TYPES = (3, 6)
+
+# functions
+
+
+def is_available():
+    return shapely is not None and shapely.__version__ >= "2"
+
+
+def export_wkb(features):
+    """Ids and WKB of the features with a geometry"""
+    fids = []
+    wkb = []
+    for feat in features:
+        if feat.hasGeometry():
+            fids.append(feat.id())
+            wkb.append(bytes(feat.geometry().asWkb()))
+    return fids, wkb
+
+
+def intersect_wkb(prospect_wkb, search_wkb):
+    """Intersections of every prospect geometry with the search geometries
+
+    Takes two lists of WKB and returns arrays with the prospect index,
+    search index, number of intersections, length and area of every hit.
+    It only uses plain arrays, so it can also run in another process.
+    """
+    prospect = shapely.from_wkb(
+        np.array(prospect_wkb, dtype=object), on_invalid="ignore"
+    )
+    search = shapely.from_wkb(np.array(search_wkb, dtype=object), on_invalid="ignore")
+    tree = shapely.STRtree(search)
+    prospect_index, search_index = tree.query(prospect, predicate="intersects")
+    intersections = shapely.intersection(prospect[prospect_index], search[search_index])
+    type_ids = shapely.get_type_id(intersections)
+    points = np.isin(type_ids, POINT_TYPES)
+    lines = np.isin(type_ids, LINE_TYPES)
+    polygons = np.isin(type_ids, POLYGON_TYPES)
+    count = np.ones(len(intersections), dtype=np.int64)
+    count = np.where(lines | polygons, shapely.get_num_geometries(intersections), count)
+    count = np.where(points, shapely.get_num_coordinates(intersections), count)
+    length = np.where(lines, shapely.length(intersections), 0.0)
+    area = np.where(polygons, shapely.area(intersections), 0.0)
+    return prospect_index, search_index, count, length, area
+
+
+def get_hits(prospect_ids, prospect_wkb, fids, search_wkb) -> dict[int, list[tuple]]:
+    """Hits of every prospect feature as (feature id, intersections, length,
+    area), ordered by feature id and rounded like measure_intersection"""
+    hits = {prospect_id: [] for prospect_id in prospect_ids}
+    if not prospect_wkb or not search_wkb:
+        return hits
+    prospect_index, search_index, count, length, area = intersect_wkb(
+        prospect_wkb, search_wkb
+    )
+    fids = np.array(fids, dtype=np.int64)[search_index]
+    for i in np.lexsort((fids, prospect_index)):
+        hits[prospect_ids[prospect_index[i]]].append(
+            (
+                int(fids[i]),
+                int(count[i]),
+                round(float(length[i]), 3),
+                round(float(area[i]), 4),
+            )
+        )
+    return hits